@@ -6,11 +6,17 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from utils import model_registry, prediction_cache
+
 st.set_page_config(
     page_title="Hello",
     page_icon="👋",
 )
 
+# Start loading both models in the background while the visitor reads this
+# page, so the recommenders are warm by the time they get there
+registry = model_registry()
+
 st.write("# Welcome to Algorhythmic! 👋")
 
 
@@ -73,4 +79,10 @@ st.text("")
 st.text("")
 st.text("")
 st.text("")
-st.caption("Built by Chris Williams as part of Spiced Academy Berlin")
\ No newline at end of file
+st.caption("Built by Chris Williams as part of Spiced Academy Berlin")
+
+with st.sidebar.expander("Model status"):
+    # Load and warm-up timings, see algorhythmic.registry, and how often
+    # recordings are answered from the prediction cache
+    st.write(registry.stats())
+    st.write(prediction_cache().stats())
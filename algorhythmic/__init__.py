@@ -0,0 +1,33 @@
+# Core library behind the Streamlit pages: feature extraction, prediction
+# and vote aggregation, with no streamlit dependency. tensorflow, xgboost,
+# librosa and sklearn are only imported when a code path needs them.
+from .features import (FEATURE_PIPELINE_VERSION,
+                       important_features,
+                       name_dict,
+                       scale_data,
+                       condense_windows,
+                       condense_spotify_data,
+                       condense_output_data,
+                       condense_segments,
+                       track_features,
+                       decode_audio,
+                       output_features)
+from .spotify import (find_track,
+                      stored_track_features,
+                      fetch_track_features,
+                      GenrePools,
+                      genre_pools,
+                      pick_recommendations)
+from .predict import (weighted_votes,
+                      predict_spotify,
+                      predict_spotify_batch,
+                      predict_output,
+                      predict_output_batch,
+                      predict_output_stream)
+from .models import (load_scraping_model,
+                     load_listening_model)
+from .streaming import stream_output_features
+from .inference import XGBoostEngine
+from .analysis_cache import AnalysisCache
+from .feature_store import FeatureStore
+from .prediction_cache import PredictionCache
@@ -0,0 +1,136 @@
+# Persistent on-disk cache of Spotify audio-analysis responses. Only what the
+# feature pipeline reads is kept: the segments as a float32 matrix (see
+# features.segment_columns) and a few fields of the track section.
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from .features import build_segment_matrix
+from .instrument import count
+
+# The fields of audio_analysis['track'] that track_features uses
+TRACK_FIELDS = ['duration', 'end_of_fade_in', 'start_of_fade_out', 'tempo']
+
+
+class AnalysisCache:
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 ** 2, ttl=30 * 24 * 3600, mmap=False):
+        # max_bytes bounds the total size on disk (least recently used entries
+        # go first), ttl is in seconds (None keeps entries forever), and mmap
+        # memory-maps the segment matrices instead of reading them into memory
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.mmap = mmap
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, track_id):
+        # Content-addressed by a hash of the track ID so any ID is a safe filename
+        key = hashlib.sha1(track_id.encode()).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.npy', base + '.json'
+
+    def get(self, track_id):
+
+        segments_path, info_path = self._paths(track_id)
+
+        try:
+            with open(info_path) as file:
+                info = json.load(file)
+            if self.ttl is not None and time.time() - info['cached_at'] > self.ttl:
+                self._remove(segments_path, info_path)
+                return None
+            segments = np.load(segments_path, mmap_mode='r' if self.mmap else None)
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+        # Touch the entry so eviction sees it as recently used. Another
+        # thread or process may have evicted it since the read, which is fine,
+        # the data is already loaded.
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(info_path)
+
+        return info['track'], segments
+
+    def put(self, track_id, track_info, segments):
+
+        segments_path, info_path = self._paths(track_id)
+        info = {'track_id': track_id,
+                'cached_at': time.time(),
+                'track': {field: track_info.get(field) for field in TRACK_FIELDS}}
+
+        # Write to temporary files first so readers never see half an entry
+        self._atomic_write(segments_path, lambda file: np.save(file, segments))
+        self._atomic_write(info_path, lambda file: file.write(json.dumps(info).encode()))
+
+        self.evict()
+
+    def audio_analysis(self, sp, track_id):
+
+        # Returns (track_info, segment_matrix), going to Spotify only on a miss
+        cached = self.get(track_id)
+        if cached is not None:
+            self.hits += 1
+            count('analysis_cache.hit')
+            return cached
+
+        self.misses += 1
+        count('analysis_cache.miss')
+        audio_analysis = sp.audio_analysis(track_id)
+        track_info = audio_analysis.get('track')
+        segments = build_segment_matrix(audio_analysis['segments'])
+        self.put(track_id, track_info, segments)
+
+        return track_info, segments
+
+    def evict(self):
+
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                info_path = os.path.join(self.cache_dir, name)
+                segments_path = info_path[:-len('.json')] + '.npy'
+                try:
+                    size = os.path.getsize(info_path) + os.path.getsize(segments_path)
+                    used = os.path.getmtime(info_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((used, size, segments_path, info_path))
+                total += size
+
+            # Drop the least recently used entries until we fit
+            for used, size, segments_path, info_path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(segments_path, info_path)
+                total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json') or name.endswith('.npy'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def _atomic_write(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+        os.replace(tmp_path, path)
+
+    def _remove(self, *paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,144 @@
+# Micro-batching in front of a model. Callers submit window matrices from any
+# thread and get a Future back. A background thread gathers whatever arrives
+# within max_wait seconds of the first request, up to max_batch rows, and runs
+# the model once on all of it. Each caller then gets its own slice of the
+# predictions.
+#
+# BatchedModel wraps a MicroBatcher so it can be passed wherever a model is
+# (predict_spotify etc. only call predict / predict_proba). For Keras models,
+# keras_predictor skips model.predict's per-call setup.
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from .features import important_features
+from .instrument import count, span
+
+_STOP = object()
+
+
+class MicroBatcher:
+
+    def __init__(self, predict, max_batch=4096, max_wait=0.005, name='batch'):
+        # predict maps an (n, d) array to (n, k) predictions
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f'{name}-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, x):
+        future = Future()
+        self._queue.put((np.asarray(x), future))
+        return future
+
+    def __call__(self, x):
+        # Blocking submit, for callers that only want the predictions
+        return self.submit(x).result()
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        return {'batches': self.batches,
+                'requests': self.requests,
+                'rows': self.rows,
+                'mean_requests_per_batch': self.requests / self.batches if self.batches else 0.0,
+                'mean_rows_per_batch': self.rows / self.batches if self.batches else 0.0}
+
+    def _gather(self, first):
+
+        # The first request plus whatever else arrives before the deadline
+        batch = [first]
+        rows = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            rows += len(item[0])
+
+        return batch, False
+
+    def _run(self):
+
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stop = self._gather(first)
+
+            # Futures cancelled while queued are dropped
+            batch = [(x, future) for x, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            offsets = np.cumsum([0] + [len(x) for x, _ in batch])
+            self.batches += 1
+            self.requests += len(batch)
+            self.rows += int(offsets[-1])
+            count(f'{self.name}.requests', len(batch))
+
+            try:
+                with span(f'{self.name}.predict', requests=len(batch), rows=int(offsets[-1])):
+                    preds = self.predict(np.concatenate([x for x, _ in batch]))
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            for n, (_, future) in enumerate(batch):
+                future.set_result(preds[offsets[n]:offsets[n + 1]])
+
+
+def keras_predictor(model, n_features):
+
+    # model(x, training=False) behind a tf.function with a fixed input
+    # signature, so it's traced once for every batch size instead of going
+    # through model.predict's data adapter and callbacks on each call
+    import tensorflow as tf
+
+    call = tf.function(lambda x: model(x, training=False),
+                       input_signature=[tf.TensorSpec([None, n_features], tf.float32)])
+    return lambda x: call(np.asarray(x, dtype=np.float32)).numpy()
+
+
+class BatchedModel:
+
+    def __init__(self, predict, max_batch=4096, max_wait=0.002, name='batched'):
+        self.batcher = MicroBatcher(predict, max_batch, max_wait, name)
+
+    def predict(self, x, **kwargs):
+        return self.batcher(np.asarray(x, dtype=np.float32))
+
+    def predict_proba(self, x):
+        return self.batcher(np.asarray(x, dtype=np.float32))
+
+    def close(self):
+        self.batcher.close()
+
+
+def batched_keras_model(model, max_batch=4096, max_wait=0.002):
+    # The scraping model with concurrent predict calls merged into one. An
+    # exported DenseModel (see algorhythmic.dense) is batched through its
+    # own predict.
+    if hasattr(model, 'layers'):
+        predict = keras_predictor(model, len(important_features))
+    else:
+        predict = model.predict
+    return BatchedModel(predict, max_batch, max_wait, name='scraping')
@@ -0,0 +1,270 @@
+# Offline genre labels for a directory of recordings, through the same
+# pipeline as predict_output. Files are decoded and featurized on a pool of
+# worker processes, each with its own single-threaded copy of the listening
+# model, and the windows of a chunk of files go through one inplace_predict.
+#
+#   python -m algorhythmic.classify AUDIO_DIR --out labels.csv [--workers N]
+#
+# Results are written as each chunk finishes, one row per file. Running the
+# same command again skips files already in --out, so an interrupted run
+# picks up where it stopped. Files that failed (error set) are tried again,
+# and their new row replaces the old one when the run finishes. A file too
+# short for one window is done too, with windows 0 and no error or genres.
+# A .parquet --out is built from part files in <out>.parts/ and assembled
+# when every file is done.
+import argparse
+import contextlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from .features import condense_output_features, decode_audio, signal_features
+from .inference import XGBoostEngine
+from .models import LISTENING_MODEL_PATH
+from .predict import weighted_votes
+
+AUDIO_EXTENSIONS = ('.wav', '.flac')
+
+# Thread pools each worker keeps to one thread
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMBA_NUM_THREADS']
+
+result_columns = ['path', 'windows',
+                  'genre_1', 'votes_1', 'genre_2', 'votes_2', 'genre_3', 'votes_3',
+                  'error']
+
+# Set per worker process by _init_worker
+_engine = None
+_decode = None
+
+
+def audio_files(audio_dir):
+    # Every WAV/FLAC under audio_dir, as sorted paths relative to it
+    files = []
+    for dirpath, _, names in os.walk(audio_dir):
+        for name in names:
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                files.append(os.path.relpath(os.path.join(dirpath, name), audio_dir))
+    return sorted(files)
+
+
+def result_row(path, probs=None, error=None):
+
+    row = dict.fromkeys(result_columns)
+    row.update(path=path, windows=0 if probs is None else len(probs), error=error)
+    if probs is not None:
+        votes = weighted_votes(probs, top=3)['Weighted Votes']
+        for n, (genre, points) in enumerate(votes.items(), start=1):
+            row[f'genre_{n}'] = genre
+            row[f'votes_{n}'] = points
+
+    return row
+
+
+@contextlib.contextmanager
+def single_threaded_workers():
+
+    # One core per worker. The pool spawns fresh interpreters (at any point
+    # while it runs), so the variables have to be in this process's
+    # environment for as long as the pool is up to reach numpy/numba before
+    # they start their own thread pools. Restored afterwards.
+    saved = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+    for name in THREAD_VARIABLES:
+        os.environ.setdefault(name, '1')
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _init_worker(model_path, decode):
+    global _engine, _decode
+    from .models import load_listening_model
+    _engine = XGBoostEngine(load_listening_model(model_path), n_threads=1)
+    _decode = decode
+
+
+def _classify_chunk(audio_dir, paths):
+
+    # Features file by file (a file that fails to decode gets an error row,
+    # one too short for a window a row without votes), then one model call
+    # for the windows of the whole chunk
+    rows = {}
+    frames = {}
+    for path in paths:
+        try:
+            with open(os.path.join(audio_dir, path), 'rb') as file:
+                audio_bytes = file.read()
+            frame = condense_output_features(*signal_features(*decode_audio(audio_bytes, _decode)))
+        except Exception as error:
+            rows[path] = result_row(path, error=f'{type(error).__name__}: {error}')
+            continue
+        if len(frame) == 0:
+            rows[path] = result_row(path)
+        else:
+            frames[path] = frame
+
+    if frames:
+        for path, probs in zip(frames, _engine.predict_many(list(frames.values()))):
+            rows[path] = result_row(path, probs)
+
+    return [rows[path] for path in paths]
+
+
+class ResultWriter:
+
+    def __init__(self, out):
+        self.out = out
+        self.parquet = out.endswith('.parquet')
+        self.parts_dir = out + '.parts'
+        self.parts = 0
+        if self.parquet:
+            os.makedirs(self.parts_dir, exist_ok=True)
+            self.parts = len(os.listdir(self.parts_dir))
+
+    def done(self):
+
+        # Paths whose latest row from an earlier run has no error. Failed
+        # files (e.g. a transient I/O error) are left to be tried again.
+        columns = ['path', 'error']
+        if self.parquet:
+            tables = [os.path.join(self.parts_dir, name) for name in sorted(os.listdir(self.parts_dir))
+                      if name.endswith('.parquet')]
+            if os.path.exists(self.out):
+                tables.insert(0, self.out)
+            rows = [pd.read_parquet(path, columns=columns) for path in tables]
+        elif os.path.exists(self.out) and os.path.getsize(self.out):
+            rows = [pd.read_csv(self.out, usecols=columns)]
+        else:
+            rows = []
+        if not rows:
+            return set()
+
+        latest = pd.concat(rows, ignore_index=True).drop_duplicates('path', keep='last')
+        return set(latest.loc[latest['error'].isna(), 'path'])
+
+    def write(self, rows):
+        df = pd.DataFrame(rows, columns=result_columns)
+        if self.parquet:
+            # Part files are written whole (temporary name first), so a crash
+            # never leaves half of one
+            path = os.path.join(self.parts_dir, f'part-{self.parts:06d}.parquet')
+            fd, tmp_path = tempfile.mkstemp(dir=self.parts_dir, suffix='.tmp')
+            os.close(fd)
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+            self.parts += 1
+        else:
+            header = not os.path.exists(self.out) or not os.path.getsize(self.out)
+            with open(self.out, 'a', newline='') as file:
+                df.to_csv(file, header=header, index=False)
+
+    def close(self):
+
+        # One row per file, the latest, so a retried file's old error row goes.
+        # For Parquet, one file out of an earlier one (if any) and the parts.
+        if not self.parquet:
+            if os.path.exists(self.out) and os.path.getsize(self.out):
+                df = pd.read_csv(self.out)
+                if df['path'].duplicated().any():
+                    self._replace(df.drop_duplicates('path', keep='last'))
+            return
+        paths = [os.path.join(self.parts_dir, name) for name in sorted(os.listdir(self.parts_dir))
+                 if name.endswith('.parquet')]
+        if not paths:
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            return
+        if os.path.exists(self.out):
+            paths.insert(0, self.out)
+        df = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+        self._replace(df.drop_duplicates('path', keep='last'))
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    def _replace(self, df):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.out)), suffix='.tmp')
+        os.close(fd)
+        if self.parquet:
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.out)
+
+
+def classify_directory(audio_dir, out, model_path=LISTENING_MODEL_PATH, workers=None, chunk_size=8,
+                       decode='librosa', report_every=10.0, log=print):
+
+    writer = ResultWriter(out)
+    done = writer.done()
+    paths = [path for path in audio_files(audio_dir) if path not in done]
+    chunks = [paths[n:n + chunk_size] for n in range(0, len(paths), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, max(len(chunks), 1))
+    log(f"{len(paths)} files to classify ({len(done)} already done) on {workers} workers")
+
+    start = time.perf_counter()
+    files = errors = 0
+    last_report = start
+    with single_threaded_workers(), \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                initializer=_init_worker, initargs=(model_path, decode)) as pool:
+        # A couple of chunks per worker in flight, so results stream out
+        # without queueing the whole directory
+        pending = set()
+        queued = iter(chunks)
+        while True:
+            for chunk in queued:
+                pending.add(pool.submit(_classify_chunk, audio_dir, chunk))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                rows = future.result()
+                writer.write(rows)
+                files += len(rows)
+                errors += sum(row['error'] is not None for row in rows)
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                log(f"{files}/{len(paths)} files, {files / (now - start):.1f} files/s")
+                last_report = now
+
+    writer.close()
+    seconds = time.perf_counter() - start
+    summary = {'files': files,
+               'errors': errors,
+               'skipped': len(done),
+               'workers': workers,
+               'seconds': seconds,
+               'files_per_second': files / seconds if seconds else 0.0}
+    log(f"Classified {files} files in {seconds:.1f}s ({summary['files_per_second']:.1f} files/s, "
+        f"{errors} errors) into {out}")
+
+    return summary
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Classify the genre of every WAV/FLAC in a directory')
+    parser.add_argument('audio_dir')
+    parser.add_argument('--out', default='labels.csv', help='.csv or .parquet')
+    parser.add_argument('--model', default=LISTENING_MODEL_PATH)
+    parser.add_argument('--workers', type=int, help='worker processes (default: every core)')
+    parser.add_argument('--chunk-size', type=int, default=8, help='files per model call')
+    parser.add_argument('--decode', default='librosa', choices=['librosa', 'native', 'polyphase'])
+    args = parser.parse_args()
+
+    classify_directory(args.audio_dir, args.out, args.model, args.workers, args.chunk_size, args.decode)
+
+
+if __name__ == '__main__':
+    main()
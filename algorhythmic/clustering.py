@@ -0,0 +1,454 @@
+# Out-of-core clustering of songs into data-driven categories (the README's
+# "1,000,000 songs into about 200 categories"). Condensed 3 second windows are
+# kept on disk as sharded float32 .npy files over important_features and are
+# only ever memory-mapped, so the dataset never has to fit in memory.
+#
+# Fitting is mini-batch k-means spread over a process pool. Every round each
+# worker samples a batch from a shard and returns per-cluster sums and counts
+# against the current centroids. The driver folds them in with the usual
+# per-centroid learning rate (1 / points seen), which is the same update as
+# sequential mini-batch k-means over the combined batch. A checkpoint is written
+# every few rounds and fitting picks up from it when restarted.
+#
+#   python -m algorhythmic.clustering shard --from-csv ./data/ --shards ./cache/shards/
+#   python -m algorhythmic.clustering fit --shards ./cache/shards/ --k 200 --out ./models/clusters/
+#
+# The output directory holds the centroids, the standardisation stats, one
+# int32 assignment file per shard (row-aligned with the shard) and, when the
+# shards were written with song keys, the majority cluster of every song.
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .features import important_features
+
+
+def shard_paths(shard_dir):
+    return sorted(os.path.join(shard_dir, name) for name in os.listdir(shard_dir)
+                  if name.startswith('shard-') and name.endswith('.npy')
+                  and not name.endswith('.keys.npy'))
+
+
+def _atomic_save(path, array):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        np.save(file, array)
+    os.replace(tmp_path, path)
+
+
+def _atomic_json(path, value):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(value, file)
+    os.replace(tmp_path, path)
+
+
+def write_shards(frames, shard_dir, rows_per_shard=1_000_000, keys=True):
+
+    # frames is an iterable of DataFrames with important_features (and title
+    # and artist when keys is set), e.g. read_csv chunks. Rows are buffered
+    # into shards of rows_per_shard windows.
+    os.makedirs(shard_dir, exist_ok=True)
+    buffered = []
+    n_buffered = 0
+    n_shards = 0
+
+    def flush(rows):
+        nonlocal n_shards
+        chunk = pd.concat(buffered, ignore_index=True) if len(buffered) > 1 else buffered[0]
+        base = os.path.join(shard_dir, f'shard-{n_shards:05d}')
+        _atomic_save(base + '.npy', chunk[important_features].to_numpy(np.float32)[:rows])
+        if keys:
+            song_keys = (chunk['title'].astype(str) + '\t' + chunk['artist'].astype(str))
+            _atomic_save(base + '.keys.npy', song_keys.to_numpy(dtype=str)[:rows])
+        n_shards += 1
+        return chunk.iloc[rows:]
+
+    for frame in frames:
+        buffered.append(frame)
+        n_buffered += len(frame)
+        while n_buffered >= rows_per_shard:
+            rest = flush(rows_per_shard)
+            buffered = [rest] if len(rest) else []
+            n_buffered = len(rest)
+
+    if n_buffered:
+        flush(n_buffered)
+
+    return n_shards
+
+
+def shard_csvs(data_dir, shard_dir, rows_per_shard=1_000_000, chunksize=100_000):
+
+    # The training CSVs (see make_full_df) as shards, read in chunks with only
+    # the needed columns
+    csv_files = sorted(file for file in os.listdir(data_dir) if file.endswith('.csv'))
+    dtypes = dict.fromkeys(important_features, np.float32)
+
+    def frames():
+        for file in csv_files:
+            yield from pd.read_csv(os.path.join(data_dir, file), chunksize=chunksize,
+                                   usecols=['title', 'artist'] + important_features, dtype=dtypes)
+
+    return write_shards(frames(), shard_dir, rows_per_shard)
+
+
+def squared_distances(x, vectors, vector_norms=None):
+    # |x - v|^2 = |x|^2 - 2 x.v + |v|^2, the x.v part is a single matmul.
+    # vector_norms (the |v|^2) can be passed in when the vectors don't change.
+    if vector_norms is None:
+        vector_norms = np.einsum('ij,ij->i', vectors, vectors)
+    distances = np.einsum('ij,ij->i', x, x)[:, None] - 2 * x @ vectors.T + vector_norms[None, :]
+    return np.maximum(distances, 0)
+
+
+def nearest(x, centroids):
+    return squared_distances(x, centroids).argmin(axis=1)
+
+
+def standardise(x, center, scale):
+    # NaNs (features a window doesn't have) become the mean
+    return np.nan_to_num((np.asarray(x, dtype=np.float32) - center) / scale)
+
+
+def _moments(path):
+    # Count, sum and sum of squares per feature, ignoring NaNs
+    x = np.load(path, mmap_mode='r')
+    n = np.zeros(x.shape[1])
+    total = np.zeros(x.shape[1])
+    squares = np.zeros(x.shape[1])
+    for start in range(0, len(x), 100_000):
+        chunk = np.asarray(x[start:start + 100_000], dtype=np.float64)
+        finite = np.isfinite(chunk)
+        chunk = np.where(finite, chunk, 0)
+        n += finite.sum(axis=0)
+        total += chunk.sum(axis=0)
+        squares += (chunk ** 2).sum(axis=0)
+    return n, total, squares
+
+
+def _sample(path, n_rows, seed):
+    x = np.load(path, mmap_mode='r')
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(x), min(n_rows, len(x)), replace=False))
+    return np.asarray(x[rows])
+
+
+def _batch_stats(path, batch_size, seed, centroids, center, scale):
+
+    # One worker's share of a round: per-cluster sums and counts of a random
+    # batch from one shard, and the batch's inertia
+    batch = standardise(_sample(path, batch_size, seed), center, scale)
+    distances = squared_distances(batch, centroids)
+    labels = distances.argmin(axis=1)
+
+    k, d = centroids.shape
+    counts = np.bincount(labels, minlength=k)
+    sums = np.zeros((k, d))
+    np.add.at(sums, labels, batch)
+
+    return sums, counts, float(distances[np.arange(len(batch)), labels].sum())
+
+
+def _assign_shard(path, out_path, centroids, center, scale, chunk=200_000):
+
+    x = np.load(path, mmap_mode='r')
+    labels = np.empty(len(x), dtype=np.int32)
+    inertia = 0.0
+    for start in range(0, len(x), chunk):
+        distances = squared_distances(standardise(x[start:start + chunk], center, scale), centroids)
+        labels[start:start + chunk] = distances.argmin(axis=1)
+        inertia += float(distances.min(axis=1).sum())
+    _atomic_save(out_path, labels)
+
+    return np.bincount(labels, minlength=len(centroids)), inertia
+
+
+def kmeans_plus_plus(x, k, rng):
+
+    # k-means++ seeding on an in-memory sample
+    centroids = np.empty((k, x.shape[1]), dtype=np.float32)
+    centroids[0] = x[rng.integers(len(x))]
+    closest = squared_distances(x, centroids[:1])[:, 0].astype(np.float64)
+    for n in range(1, k):
+        total = closest.sum()
+        pick = rng.choice(len(x), p=closest / total) if total > 0 else rng.integers(len(x))
+        centroids[n] = x[pick]
+        closest = np.minimum(closest, squared_distances(x, centroids[n:n + 1])[:, 0])
+    return centroids
+
+
+def kmeans(x, k, iterations=20, seed=0):
+
+    # Plain in-memory k-means (k-means++ seeding, then Lloyd iterations), for
+    # data small enough to hold, like the similarity index's IVF lists.
+    # Returns (centroids, labels).
+    x = np.asarray(x, dtype=np.float32)
+    centroids = kmeans_plus_plus(x, k, np.random.default_rng(seed))
+    for _ in range(iterations):
+        labels = nearest(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros((k, x.shape[1]))
+        np.add.at(sums, labels, x)
+        # Empty clusters keep their centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+
+    return centroids, nearest(x, centroids)
+
+
+class ShardedKMeans:
+
+    def __init__(self, k=200, batch_size=4096, max_rounds=500, tol=1e-4, workers=None,
+                 checkpoint_every=10, seed=0):
+        # batch_size is per worker per round, tol stops fitting once no
+        # centroid moves more than tol (in standardised units) in a round
+        self.k = k
+        self.batch_size = batch_size
+        self.max_rounds = max_rounds
+        self.tol = tol
+        self.workers = workers or os.cpu_count() or 1
+        self.checkpoint_every = checkpoint_every
+        self.seed = seed
+
+    def _settings(self, paths, sizes):
+        # workers is here because it sets how many batches each round draws
+        return {'k': self.k,
+                'batch_size': self.batch_size,
+                'workers': self.workers,
+                'seed': self.seed,
+                'features': important_features,
+                'shards': [[os.path.basename(path), size] for path, size in zip(paths, sizes)]}
+
+    def fit(self, shard_dir, out_dir, resume=True, log=print):
+
+        paths = shard_paths(shard_dir)
+        if not paths:
+            raise ValueError(f"No shards in {shard_dir}")
+        sizes = [len(np.load(path, mmap_mode='r')) for path in paths]
+        weights = np.array(sizes) / sum(sizes)
+        settings = self._settings(paths, sizes)
+
+        os.makedirs(out_dir, exist_ok=True)
+        checkpoint_path = os.path.join(out_dir, 'checkpoint.npz')
+        settings_path = os.path.join(out_dir, 'checkpoint.json')
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            state = self._load_checkpoint(checkpoint_path, settings_path, settings) if resume else None
+
+            if state is not None:
+                centroids, seen, center, scale, start_round, history = state
+                log(f"Resuming at round {start_round}")
+            else:
+                # Standardisation stats in one parallel pass
+                n, total, squares = map(sum, zip(*pool.map(_moments, paths)))
+                center = (total / np.maximum(n, 1)).astype(np.float32)
+                scale = np.sqrt(np.maximum(squares / np.maximum(n, 1) - center.astype(np.float64) ** 2, 0))
+                scale = np.where(scale > 0, scale, 1).astype(np.float32)
+
+                # Seed on a sample drawn across shards, in proportion to their size
+                sample_rows = max(20 * self.k, 10_000)
+                samples = pool.map(_sample, paths,
+                                   [max(1, int(sample_rows * w)) for w in weights],
+                                   [self.seed + n for n in range(len(paths))])
+                sample = standardise(np.concatenate(list(samples)), center, scale)
+                if len(sample) < self.k:
+                    raise ValueError(f"Only {len(sample)} rows for k={self.k}")
+                centroids = kmeans_plus_plus(sample, self.k, np.random.default_rng(self.seed))
+                seen = np.zeros(self.k)
+                start_round = 0
+                history = []
+
+            for round_ in range(start_round, self.max_rounds):
+                started = time.perf_counter()
+
+                # The seed depends only on the round, so a resumed fit draws
+                # the same batches it would have
+                rng = np.random.default_rng([self.seed, round_])
+                picks = rng.choice(len(paths), self.workers, p=weights)
+                seeds = rng.integers(2 ** 32, size=self.workers)
+                results = list(pool.map(_batch_stats, [paths[n] for n in picks],
+                                        [self.batch_size] * self.workers, seeds,
+                                        [centroids] * self.workers, [center] * self.workers,
+                                        [scale] * self.workers))
+
+                sums = sum(result[0] for result in results)
+                counts = sum(result[1] for result in results)
+                inertia = sum(result[2] for result in results) / counts.sum()
+
+                # c += (sum - n c) / seen, per centroid
+                previous = centroids.copy()
+                seen += counts
+                moved = counts > 0
+                centroids[moved] += ((sums[moved] - counts[moved, None] * centroids[moved])
+                                     / seen[moved, None]).astype(np.float32)
+                shift = float(np.sqrt(((centroids - previous) ** 2).sum(axis=1)).max())
+
+                history.append({'round': round_, 'inertia': inertia, 'shift': shift,
+                                'seconds': time.perf_counter() - started})
+
+                converged = shift < self.tol
+                done = converged or round_ + 1 == self.max_rounds
+                if (round_ + 1) % self.checkpoint_every == 0 or done:
+                    self._save_checkpoint(checkpoint_path, settings_path, settings, centroids,
+                                          seen, center, scale, round_ + 1, history, converged)
+                    log(f"Round {round_ + 1}: mean batch inertia {inertia:.4f}, max shift {shift:.5f}")
+                if done:
+                    break
+
+            # Final assignment pass over every shard
+            assignment_dir = os.path.join(out_dir, 'assignments')
+            os.makedirs(assignment_dir, exist_ok=True)
+            out_paths = [os.path.join(assignment_dir, os.path.basename(path)) for path in paths]
+            assigned = list(pool.map(_assign_shard, paths, out_paths, [centroids] * len(paths),
+                                     [center] * len(paths), [scale] * len(paths)))
+
+        cluster_sizes = sum(sizes for sizes, _ in assigned)
+        inertia = sum(inertia for _, inertia in assigned) / sum(sizes)
+
+        _atomic_save(os.path.join(out_dir, 'centroids.npy'), centroids)
+        np.savez(os.path.join(out_dir, 'stats.npz'), center=center, scale=scale)
+        _atomic_json(os.path.join(out_dir, 'meta.json'),
+                     {'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                      'k': self.k,
+                      'rows': int(sum(sizes)),
+                      'rounds': len(history),
+                      'inertia': inertia,
+                      'empty_clusters': int((cluster_sizes == 0).sum()),
+                      'cluster_sizes': cluster_sizes.tolist(),
+                      'features': important_features})
+
+        song_clusters(paths, out_paths, os.path.join(out_dir, 'song_clusters.csv'))
+
+        return ClusterModel.load(out_dir)
+
+    def _save_checkpoint(self, checkpoint_path, settings_path, settings, centroids, seen,
+                         center, scale, round_, history, converged):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(checkpoint_path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            np.savez(file, centroids=centroids, seen=seen, center=center, scale=scale)
+        os.replace(tmp_path, checkpoint_path)
+        _atomic_json(settings_path, {'settings': settings, 'round': round_, 'converged': converged,
+                                    'history': history})
+
+    def _load_checkpoint(self, checkpoint_path, settings_path, settings):
+        if not os.path.exists(checkpoint_path) or not os.path.exists(settings_path):
+            return None
+        with open(settings_path) as file:
+            saved = json.load(file)
+        if saved['settings'] != json.loads(json.dumps(settings)):
+            raise ValueError(f"{checkpoint_path} was made with different settings (k, batch size, "
+                             "workers, seed) or shards, remove it or fit without resuming")
+        checkpoint = np.load(checkpoint_path)
+        # A converged fit goes straight to the assignment pass, otherwise a
+        # larger max_rounds carries on from where it stopped
+        start_round = self.max_rounds if saved['converged'] else saved['round']
+        return (checkpoint['centroids'], checkpoint['seen'], checkpoint['center'],
+                checkpoint['scale'], start_round, saved['history'])
+
+
+def song_clusters(paths, assignment_paths, out_path):
+
+    # The most common cluster of each song's windows, for shards written with
+    # keys. Returns the number of songs.
+    frames = []
+    for path, assignment_path in zip(paths, assignment_paths):
+        keys_path = path[:-len('.npy')] + '.keys.npy'
+        if not os.path.exists(keys_path):
+            return 0
+        frames.append(pd.DataFrame({'key': np.load(keys_path), 'cluster': np.load(assignment_path)}))
+
+    counts = pd.concat(frames, ignore_index=True).value_counts(['key', 'cluster']).reset_index()
+    best = counts.drop_duplicates('key', keep='first')
+    title_artist = best['key'].str.split('\t', n=1, expand=True)
+    out = pd.DataFrame({'title': title_artist[0], 'artist': title_artist[1],
+                        'cluster': best['cluster'].to_numpy(), 'windows': best['count'].to_numpy()})
+    out.to_csv(out_path, index=False)
+
+    return len(out)
+
+
+class ClusterModel:
+
+    def __init__(self, centroids, center, scale, meta=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.center = np.asarray(center, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, out_dir):
+        stats = np.load(os.path.join(out_dir, 'stats.npz'))
+        meta_path = os.path.join(out_dir, 'meta.json')
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                meta = json.load(file)
+        return cls(np.load(os.path.join(out_dir, 'centroids.npy')), stats['center'], stats['scale'], meta)
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def assign(self, df):
+
+        # Cluster of every window. Features the frame doesn't have (e.g. the
+        # Spotify loudness columns for a recorded clip) are left out of the
+        # distance.
+        x = df.reindex(columns=important_features).to_numpy(np.float32)
+        x = (x - self.center) / self.scale
+        mask = np.isfinite(x).all(axis=0)
+        return squared_distances(np.nan_to_num(x[:, mask]), self.centroids[:, mask]).argmin(axis=1)
+
+    def cluster_votes(self, df, top=3):
+        # The clusters a track's windows fall in, most common first
+        labels = self.assign(df)
+        counts = np.bincount(labels, minlength=len(self))
+        best = np.argsort(-counts, kind='stable')[:top]
+        best = best[counts[best] > 0]
+        return pd.DataFrame({'Windows': counts[best], 'Share': counts[best] / len(labels)},
+                            index=[f'cluster {n}' for n in best])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Cluster songs into data-driven categories')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    shard = commands.add_parser('shard', help='convert the training CSVs into shards')
+    shard.add_argument('--from-csv', metavar='DATA_DIR', default='./data/')
+    shard.add_argument('--shards', default='./cache/shards/')
+    shard.add_argument('--rows-per-shard', type=int, default=1_000_000)
+
+    fit = commands.add_parser('fit', help='fit mini-batch k-means over the shards')
+    fit.add_argument('--shards', default='./cache/shards/')
+    fit.add_argument('--out', default='./models/clusters/')
+    fit.add_argument('--k', type=int, default=200)
+    fit.add_argument('--batch-size', type=int, default=4096, help='rows per worker per round')
+    fit.add_argument('--max-rounds', type=int, default=500)
+    fit.add_argument('--tol', type=float, default=1e-4)
+    fit.add_argument('--workers', type=int, default=None)
+    fit.add_argument('--checkpoint-every', type=int, default=10)
+    fit.add_argument('--seed', type=int, default=0)
+    fit.add_argument('--fresh', action='store_true', help='ignore any checkpoint in --out')
+
+    args = parser.parse_args()
+
+    if args.command == 'shard':
+        n_shards = shard_csvs(args.from_csv, args.shards, args.rows_per_shard)
+        print(f"Wrote {n_shards} shards to {args.shards}")
+    else:
+        model = ShardedKMeans(args.k, args.batch_size, args.max_rounds, args.tol, args.workers,
+                              args.checkpoint_every, args.seed)
+        clusters = model.fit(args.shards, args.out, resume=not args.fresh)
+        print(f"{len(clusters)} clusters over {clusters.meta['rows']} windows in "
+              f"{clusters.meta['rounds']} rounds, written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
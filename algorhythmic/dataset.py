@@ -0,0 +1,155 @@
+# Loader for the training dataset in ./data/ (one CSV per genre playlist, one
+# row per 3 second window). Only the requested columns are read, with
+# compact dtypes: float32 features and categorical text columns. The first
+# load converts the CSVs into a single Parquet file under cache_dir. Later
+# loads read that file, until a CSV is added, removed or modified.
+#
+# The fingerprint identifies the source files, the columns and the loader
+# version. Anything derived from the dataset can use it as a cache key.
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Bump when a change here changes the loaded frame, so old caches are ignored
+DATASET_VERSION = 1
+
+text_columns = ['title', 'artist', 'genre']
+
+
+def source_files(data_dir):
+    return sorted(os.path.join(data_dir, file) for file in os.listdir(data_dir) if file.endswith('.csv'))
+
+
+def dataset_fingerprint(data_dir, columns=None):
+
+    # Changes whenever a source CSV is added, removed or rewritten (by name,
+    # size and mtime) or a different set of columns is asked for
+    digest = hashlib.sha1()
+    digest.update(json.dumps([DATASET_VERSION, sorted(columns) if columns else None]).encode())
+    for path in source_files(data_dir):
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0'.encode())
+
+    return digest.hexdigest()[:16]
+
+
+def read_csvs(data_dir, columns=None):
+
+    # The CSVs straight into compact dtypes, with only the given columns
+    frames = []
+    for path in source_files(data_dir):
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = [col for col in header if columns is None or col in columns]
+        dtypes = {col: (str if col in text_columns else np.float32) for col in usecols}
+        frames.append(pd.read_csv(path, usecols=usecols, dtype=dtypes))
+
+    df = pd.concat(frames, ignore_index=True)
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+
+    for col in df.columns:
+        if col in text_columns:
+            df[col] = df[col].astype('category')
+        elif col == 'year' and df[col].notna().all():
+            df[col] = df[col].astype(np.int16)
+
+    return df
+
+
+def load_dataset(data_dir='./data/', columns=None, cache_dir='./cache/dataset/'):
+
+    # Returns (df, fingerprint). cache_dir=None always reads the CSVs.
+    fingerprint = dataset_fingerprint(data_dir, columns)
+    if cache_dir is None:
+        return read_csvs(data_dir, columns), fingerprint
+
+    # One cache per set of columns, named by the columns and the fingerprint
+    columns_key = hashlib.sha1(json.dumps(sorted(columns) if columns else None).encode()).hexdigest()[:8]
+    prefix = f'dataset-{columns_key}-'
+    cache_path = os.path.join(cache_dir, f'{prefix}{fingerprint}.parquet')
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path), fingerprint
+
+    df = read_csvs(data_dir, columns)
+
+    # Write to a temporary file first so readers never see half a cache, then
+    # drop the caches of older versions of the data with the same columns
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    os.close(fd)
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.parquet') and fingerprint not in name:
+            os.remove(os.path.join(cache_dir, name))
+
+    return df, fingerprint
+
+
+def box_stats(df, features, by='genre', whis=1.5):
+
+    # Box plot statistics of every feature per group, the way matplotlib
+    # draws them: quartiles, whiskers at the furthest points within whis * IQR
+    # of the box, and the points beyond the whiskers as outliers. Groups are
+    # in order of first appearance. Returns (stats, outliers) in long form.
+    codes, groups = pd.factorize(df[by].astype(str), sort=False)
+    values = df[features].to_numpy(np.float64)
+    by_group = pd.DataFrame(values, columns=features).groupby(codes)
+
+    quartiles = by_group.quantile([0.25, 0.5, 0.75])
+    q1 = quartiles.xs(0.25, level=1).to_numpy()
+    median = quartiles.xs(0.5, level=1).to_numpy()
+    q3 = quartiles.xs(0.75, level=1).to_numpy()
+
+    # Fences for every row at once, from its group's quartiles
+    iqr = q3 - q1
+    low_fence = (q1 - whis * iqr)[codes]
+    high_fence = (q3 + whis * iqr)[codes]
+    inside = (values >= low_fence) & (values <= high_fence)
+
+    within = pd.DataFrame(np.where(inside, values, np.nan), columns=features).groupby(codes)
+    lower = within.min().to_numpy()
+    upper = within.max().to_numpy()
+    count = by_group.count().to_numpy()
+
+    stats = pd.DataFrame({by: np.repeat(groups, len(features)),
+                          'feature': np.tile(features, len(groups)),
+                          'q1': q1.ravel(), 'median': median.ravel(), 'q3': q3.ravel(),
+                          'lower': lower.ravel(), 'upper': upper.ravel(), 'count': count.ravel()})
+
+    rows, cols = np.nonzero(~inside & ~np.isnan(values))
+    outliers = pd.DataFrame({by: groups[codes[rows]],
+                             'feature': np.array(features)[cols],
+                             'value': values[rows, cols]})
+
+    return stats, outliers
+
+
+def load_box_stats(df, fingerprint, features, by='genre', cache_dir='./cache/dataset/'):
+
+    # box_stats of the dataset with this fingerprint, computed once and kept
+    # next to the dataset cache
+    key = hashlib.sha1(json.dumps([by, features]).encode()).hexdigest()[:8]
+    paths = [os.path.join(cache_dir, f'{name}-{key}-{fingerprint}.parquet')
+             for name in ('boxstats', 'outliers')]
+    if all(os.path.exists(path) for path in paths):
+        return tuple(pd.read_parquet(path) for path in paths)
+
+    tables = box_stats(df, features, by)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for table, path in zip(tables, paths):
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        os.close(fd)
+        table.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    for name in os.listdir(cache_dir):
+        if (name.startswith(('boxstats-' + key, 'outliers-' + key)) and name.endswith('.parquet')
+                and fingerprint not in name):
+            os.remove(os.path.join(cache_dir, name))
+
+    return tables
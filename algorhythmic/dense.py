@@ -0,0 +1,138 @@
+# The scraping model as plain NumPy. It is a stack of Dense layers (dropout
+# only matters in training), so inference is a few matmuls, and serving it
+# needs neither tensorflow nor the SavedModel. export_keras writes the weights
+# of a loaded Keras model to one .npz file:
+#
+#   python -m algorhythmic.dense --out ./models/scraping_dense.npz [--dtype float16|int8]
+#
+# float16 halves the file and int8 quarters it, with per-output-unit scales.
+# Weights are expanded back to float32 on load, so quantization only trades
+# file size (and load time) against accuracy, not inference speed.
+import argparse
+import json
+
+import numpy as np
+
+ACTIVATIONS = ['linear', 'relu', 'leaky_relu', 'softmax', 'sigmoid', 'tanh']
+
+
+def activation_of(layer):
+
+    # (name, negative slope) of a Keras Dense layer's activation, which is
+    # either a function (keras.activations.*) or a layer like LeakyReLU
+    activation = layer.activation
+    name = getattr(activation, '__name__', None) or type(activation).__name__
+    name = {'LeakyReLU': 'leaky_relu', 'ReLU': 'relu', 'Softmax': 'softmax'}.get(name, name)
+    if name not in ACTIVATIONS:
+        raise ValueError(f"Unsupported activation in {layer.name}: {name}")
+    if name != 'leaky_relu':
+        return name, 0.0
+
+    # A guessed slope would quietly export a different network
+    slope = getattr(activation, 'negative_slope', getattr(activation, 'alpha', None))
+    if slope is None:
+        raise ValueError(f"Can't tell the leaky_relu slope of {layer.name}")
+    return name, float(slope)
+
+
+def quantize(kernel, dtype):
+    if dtype == 'float32':
+        return {'kernel': kernel.astype(np.float32)}
+    if dtype == 'float16':
+        return {'kernel': kernel.astype(np.float16)}
+    if dtype == 'int8':
+        # Symmetric, one scale per output unit
+        scale = np.abs(kernel).max(axis=0) / 127
+        scale[scale == 0] = 1
+        return {'kernel': np.round(kernel / scale).astype(np.int8), 'scale': scale.astype(np.float32)}
+    raise ValueError(f"Unknown dtype: {dtype}")
+
+
+def export_keras(model, path, dtype='float32'):
+
+    arrays = {}
+    layers = []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in ('InputLayer', 'Dropout'):
+            continue
+        if kind != 'Dense':
+            raise ValueError(f"Can't export {kind} layer {layer.name}, only Dense layers")
+        kernel, bias = layer.get_weights()
+        activation, slope = activation_of(layer)
+        n = len(layers)
+        for key, value in quantize(kernel, dtype).items():
+            arrays[f'{key}_{n}'] = value
+        arrays[f'bias_{n}'] = bias.astype(np.float32)
+        layers.append({'activation': activation, 'slope': slope})
+
+    meta = {'dtype': dtype, 'layers': layers}
+    np.savez(path, meta=np.array(json.dumps(meta)), **arrays)
+
+    return DenseModel.load(path)
+
+
+class DenseModel:
+
+    def __init__(self, kernels, biases, activations):
+        self.kernels = kernels
+        self.biases = biases
+        self.activations = activations
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            meta = json.loads(str(arrays['meta']))
+            kernels = []
+            biases = []
+            for n in range(len(meta['layers'])):
+                kernel = arrays[f'kernel_{n}'].astype(np.float32)
+                if f'scale_{n}' in arrays:
+                    kernel *= arrays[f'scale_{n}']
+                kernels.append(kernel)
+                biases.append(arrays[f'bias_{n}'])
+        model = cls(kernels, biases, [(layer['activation'], layer['slope']) for layer in meta['layers']])
+        model.dtype = meta['dtype']
+        return model
+
+    def predict(self, x, **kwargs):
+
+        # Same signature as keras' predict, extra arguments are ignored
+        x = np.asarray(x, dtype=np.float32)
+        for kernel, bias, (activation, slope) in zip(self.kernels, self.biases, self.activations):
+            x = x @ kernel
+            x += bias
+            if activation == 'leaky_relu':
+                np.maximum(x, x * slope, out=x)
+            elif activation == 'relu':
+                np.maximum(x, 0, out=x)
+            elif activation == 'softmax':
+                x -= x.max(axis=1, keepdims=True)
+                np.exp(x, out=x)
+                x /= x.sum(axis=1, keepdims=True)
+            elif activation == 'sigmoid':
+                x = 1 / (1 + np.exp(-x))
+            elif activation == 'tanh':
+                np.tanh(x, out=x)
+        return x
+
+    def predict_proba(self, x):
+        return self.predict(x)
+
+
+def main():
+
+    from .models import SCRAPING_MODEL_PATH, SCRAPING_DENSE_PATH, load_scraping_model
+
+    parser = argparse.ArgumentParser(description='Export the scraping model to NumPy')
+    parser.add_argument('--model', default=SCRAPING_MODEL_PATH)
+    parser.add_argument('--out', default=SCRAPING_DENSE_PATH)
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float16', 'int8'])
+    args = parser.parse_args()
+
+    dense = export_keras(load_scraping_model(args.model, engine='keras'), args.out, args.dtype)
+    print(f"Exported {len(dense.kernels)} Dense layers as {args.dtype} to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Store of condensed Spotify windows, keyed by track ID and the feature
+# pipeline version. Each track is kept on disk as a float16 .npy shard of its
+# important_features matrix plus a small JSON of track details, with an
+# in-process LRU of DataFrames in front.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .features import FEATURE_PIPELINE_VERSION, important_features
+from .instrument import count
+
+
+class FeatureStore:
+
+    def __init__(self, store_dir, version=FEATURE_PIPELINE_VERSION, max_items=256):
+        self.store_dir = store_dir
+        self.version = version
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Entries from any other pipeline version are stale, drop them
+        self.version_dir = os.path.join(store_dir, f'v{version}')
+        os.makedirs(self.version_dir, exist_ok=True)
+        for name in os.listdir(store_dir):
+            if name.startswith('v') and name != f'v{version}':
+                shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+
+    def _paths(self, track_id):
+        key = hashlib.sha1(track_id.encode()).hexdigest()
+        base = os.path.join(self.version_dir, key)
+        return base + '.npy', base + '.json'
+
+    def get(self, track_id):
+
+        # Returns the stored frame (important_features plus track details),
+        # which predict_spotify accepts as is, or None. Every caller gets its
+        # own copy.
+        with self._lock:
+            if track_id in self._memory:
+                self._memory.move_to_end(track_id)
+                self.hits += 1
+                count('feature_store.hit')
+                # A copy, so callers can't change the remembered frame
+                return self._memory[track_id].copy()
+
+        windows_path, info_path = self._paths(track_id)
+        try:
+            with open(info_path) as file:
+                info = json.load(file)
+            windows = np.load(windows_path)
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            count('feature_store.miss')
+            return None
+
+        df = self._to_frame(windows, info)
+        with self._lock:
+            self.hits += 1
+            self._remember(track_id, df)
+        count('feature_store.hit')
+
+        return df.copy()
+
+    def put(self, track_id, df):
+
+        # Returns the frame as get will return it later, so a caller can use
+        # the same columns (and float16 values) whether or not it was stored
+        windows = df[important_features].to_numpy(np.float16)
+        info = {'track_id': track_id,
+                'title': str(df['title'].iloc[0]) if len(df) else '',
+                'artist': str(df['artist'].iloc[0]) if len(df) else '',
+                'year': str(df['year'].iloc[0]) if len(df) else ''}
+
+        windows_path, info_path = self._paths(track_id)
+        self._atomic_write(windows_path, lambda file: np.save(file, windows))
+        self._atomic_write(info_path, lambda file: file.write(json.dumps(info).encode()))
+
+        stored = self._to_frame(windows, info)
+        with self._lock:
+            self._remember(track_id, stored)
+
+        return stored.copy()
+
+    def _to_frame(self, windows, info):
+        df = pd.DataFrame(windows, columns=important_features)
+        df['tempo'] = df['tempo'].astype('uint8')
+        df['title'] = info['title']
+        df['artist'] = info['artist']
+        df['year'] = info['year']
+        return df
+
+    def _remember(self, track_id, df):
+        self._memory[track_id] = df
+        self._memory.move_to_end(track_id)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _atomic_write(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.version_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+        os.replace(tmp_path, path)
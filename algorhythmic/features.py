@@ -0,0 +1,257 @@
+# Feature extraction shared by the Spotify and listening models. Nothing in
+# here imports streamlit, and librosa/sklearn are only imported by the
+# functions that need them.
+import io
+from math import gcd
+
+import pandas as pd
+import numpy as np
+
+from .instrument import span
+from .spectral import spectral_features
+
+
+# Bump whenever a change to the feature pipeline changes the condensed values,
+# so stored features from the old pipeline are no longer used
+FEATURE_PIPELINE_VERSION = 1
+
+# Set the list of features that are important for the model
+important_features = ['tempo','start_max_std','mfcc3_mean','start_max_mean','loud_time_mean',
+                      'max_loud_mean','chroma1_mean','mfcc10_mean','mfcc5_mean','mfcc3_std',
+                      'mfcc7_mean','max_loud_std','mfcc1_mean','chroma0_mean','mfcc9_mean',
+                      'mfcc2_mean','mfcc0_mean']
+
+# Set the list of possible genres
+name_dict = {0: 'pop',1: 'rap',2: 'modern rock',3: 'urbano latino',4: 'edm',5: 'latin pop',
+            6: 'classic rock',7: 'r&b',8: 'musica mexicana',9: 'alternative metal',
+            10:'contemporary country',11: 'k-pop',12: 'canadian pop',13: 'filmi',14: 'indie pop',
+            15: 'folk rock',16: 'neo mellow',17: 'french hip hop',18: 'adult standards',
+            19: 'arrocha',20: 'new wave pop',21: 'german hip hop',22: 'house',23: 'j-pop',
+            24: 'turkish pop',25: 'soul',26: 'metal',27: 'indonesian pop',28: 'conscious hip hop',
+            29: 'stomp and holler',30: 'italian hip hop',31: 'pop punk',32: 'disco',33: 'hollywood',
+            34: 'singer-songwriter',35: 'trap argentino',36: 'dark trap',37: 'hoerspiel',38: 'indie soul',
+            39: 'nu jazz',40: 'boy band',41: 'desi hip hop',42: 'electronica',43: 'permanent wave',
+            44: 'indietronica',45: 'punk',46: 'modern blues',47: 'vapor trap',48: 'mpb',49: 'classical'}
+
+# Order of the per-segment values read from Spotify's audio analysis
+segment_columns = ([f'mfcc{n}' for n in range(12)] + [f'chroma{n}' for n in range(12)] +
+                   ['max_loud', 'start_max', 'loud_time'])
+
+# Column groups of the segment matrix that get min-max scaled (timbre, loudness)
+scaled_segment_groups = [slice(0, 12), slice(24, 26)]
+
+# Columns of the condensed MFCC (timbre) and chroma (pitch) features
+mfcc_columns = [f'mfcc{n}_mean' for n in range(12)] + [f'mfcc{n}_std' for n in range(12)]
+chroma_columns = [f'chroma{n}_mean' for n in range(12)] + [f'chroma{n}_std' for n in range(12)]
+
+# Columns returned by get_spotify_df, in order, before the track details
+spotify_columns = (mfcc_columns + chroma_columns +
+                   ['max_loud_mean', 'max_loud_std', 'start_max_mean', 'start_max_std',
+                    'loud_time_mean'])
+
+# Set up the scaling process
+def scale_data(df, scaler=None):
+    if scaler is None:
+        from sklearn import preprocessing
+        scaler = preprocessing.MinMaxScaler()
+    cols = df.columns
+    np_scaled = scaler.fit_transform(df)
+    scaled_df = pd.DataFrame(np_scaled, columns = cols)
+    return scaled_df
+
+
+# Set up a function to condense long songs into smaller chunks
+def condense_windows(df, duration, trim_front=True):
+
+    # Find the number of rows that equal 3 seconds
+    i = round(len(df) / duration * 3)
+
+    values = df.to_numpy()
+    n_rows, n_features = values.shape
+
+    # Accounting for songs with very few segments
+    if i < 2:
+        # Pair up the rows, a trailing odd row becomes its own window
+        full = n_rows - n_rows % 2
+        windows = values[:full].reshape(-1, 2, n_features)
+        mean = windows.mean(axis=1, dtype=np.float64)
+        std = windows.std(axis=1, ddof=1, dtype=np.float64)
+        if n_rows % 2:
+            mean = np.vstack([mean, values[full:].astype(np.float64)])
+            std = np.vstack([std, np.full((1, n_features), np.nan)])
+
+    else:
+        # Find the number of rows to drop such that the array divides evenly
+        # into i. Note: all feature groups will always be the same length.
+        drop_point = n_rows % i
+        # Drop the rows from whichever end is less important, then view the
+        # remaining rows as (n_windows, i, n_features) without copying.
+        if trim_front:
+            trimmed = values[drop_point:]
+        else:
+            trimmed = values[:n_rows - drop_point]
+        windows = trimmed.reshape(-1, i, n_features)
+        mean = windows.mean(axis=1, dtype=np.float64)
+        std = windows.std(axis=1, ddof=1, dtype=np.float64)
+
+    # Keep the column names that the old mean/std merge produced
+    columns = [f'{col}_x' for col in df.columns] + [f'{col}_y' for col in df.columns]
+    to_return = pd.DataFrame(np.hstack([mean, std]), columns=columns)
+
+    return to_return
+
+
+def condense_spotify_data(df, duration, fade_in, fade_out):
+    # First check which is longer, fade in/out, then drop the longer one from the DataFrame
+    # This ensures that dropped info is less important.
+    return condense_windows(df, duration, trim_front=fade_in > fade_out)
+
+
+def condense_output_data(df, duration):
+    return condense_windows(df, duration, trim_front=True)
+
+
+def build_segment_matrix(segments):
+
+    # Read every segment once into a single preallocated float32 matrix whose
+    # columns follow segment_columns
+    segment_matrix = np.empty((len(segments), len(segment_columns)), dtype=np.float32)
+
+    for row, segment in enumerate(segments):
+        segment_matrix[row, 0:12] = segment.get('timbre')
+        segment_matrix[row, 12:24] = segment.get('pitches')
+        segment_matrix[row, 24] = segment.get('loudness_max')
+        segment_matrix[row, 25] = segment.get('loudness_start')
+        segment_matrix[row, 26] = segment.get('loudness_max_time')
+
+    return segment_matrix
+
+
+def min_max_scale(values):
+
+    # Same result as MinMaxScaler, done in place on a (view of the) matrix
+    col_min = values.min(axis=0)
+    col_range = values.max(axis=0) - col_min
+    col_range[col_range == 0] = 1
+    values -= col_min
+    values /= col_range
+
+
+def condense_segments(segments, duration, fade_in, fade_out):
+
+    # segments is either the raw list from the audio analysis or a segment
+    # matrix that was already built (e.g. read back from the analysis cache)
+    if isinstance(segments, np.ndarray):
+        segment_matrix = segments.astype(np.float32, copy=True)
+    else:
+        segment_matrix = build_segment_matrix(segments)
+
+    # Only the timbre and loudness columns are scaled, pitches and
+    # loudness_max_time are already on a useful range
+    for group in scaled_segment_groups:
+        min_max_scale(segment_matrix[:, group])
+
+    segment_df = pd.DataFrame(segment_matrix, columns=segment_columns, copy=False)
+    condensed = condense_spotify_data(segment_df, duration, fade_in, fade_out)
+    condensed.columns = ([f'{col}_mean' for col in segment_columns] +
+                         [f'{col}_std' for col in segment_columns])
+
+    return condensed[spotify_columns].astype('float16')
+
+
+def track_features(sp, track, cache=None):
+
+    track_title = track['name']
+    artist_name = track['artists'][0]['name']
+    release_date = track['album']['release_date']
+    with span('spotify.audio_analysis', cached=cache is not None) as stage:
+        if cache is not None:
+            track_info, segments = cache.audio_analysis(sp, track['id'])
+        else:
+            audio_analysis = sp.audio_analysis(track['id'])
+            track_info = audio_analysis.get('track')
+            segments = audio_analysis['segments']
+        stage.set(segments=len(segments))
+    duration = track_info.get('duration')
+
+    fade_in = track_info.get('end_of_fade_in')
+    fade_out = duration - track_info.get('start_of_fade_out') 
+
+    tempo = round(track_info.get('tempo'))
+
+    with span('spotify.condense', segments=len(segments)) as stage:
+        temp_df = condense_segments(segments, duration, fade_in, fade_out)
+        stage.set(windows=len(temp_df))
+    temp_df['title'] = track_title
+    temp_df['artist'] = artist_name
+    temp_df['year'] = release_date[:4]
+    temp_df['tempo'] = tempo
+    temp_df['tempo'] = temp_df['tempo'].astype('uint8')
+
+    return temp_df
+
+
+def decode_audio(audio_bytes, decode='librosa', sr=22050):
+
+    # How the recording gets to a mono signal:
+    # * 'librosa' - librosa.load, resampled to sr with soxr_hq (what the model was trained on)
+    # * 'native' - soundfile at the recorder's own rate, features use that rate
+    # * 'polyphase' - soundfile, then scipy's polyphase resampler to sr
+    if decode == 'librosa':
+        import librosa
+        return librosa.load(io.BytesIO(audio_bytes), sr=sr)
+
+    import soundfile as sf
+    y, native_sr = sf.read(io.BytesIO(audio_bytes), dtype='float32', always_2d=True)
+    # Same mix down as librosa.to_mono
+    y = y.mean(axis=1)
+
+    if decode == 'native' or native_sr == sr:
+        return y, native_sr
+
+    if decode == 'polyphase':
+        from scipy.signal import resample_poly
+        divisor = gcd(native_sr, sr)
+        y = resample_poly(y, sr // divisor, native_sr // divisor).astype(np.float32)
+        return y, sr
+
+    raise ValueError(f"Unknown decode mode: {decode}")
+
+
+def signal_features(y, sr):
+
+    # Heavy import, only paid on the listening path
+    import librosa
+
+    duration = librosa.get_duration(y=y, sr=sr)
+    audio_file, _ = librosa.effects.trim(y)
+
+    # One STFT feeds the MFCCs, the chromagram and the tempo estimate
+    mfccs, chromagram, tempo = spectral_features(audio_file, sr)
+
+    return mfccs, chromagram, tempo, duration
+
+
+def condense_output_features(mfccs, chromagram, tempo, duration):
+
+    mfcc_df = pd.DataFrame(mfccs.T)
+    scaled_mfcc = scale_data(mfcc_df)
+    condensed_mfcc= condense_output_data(scaled_mfcc, duration)
+    condensed_mfcc.columns = mfcc_columns
+    
+    chromagram_df = pd.DataFrame(chromagram.T)
+    scaled_chroma = scale_data(chromagram_df)
+    condensed_chroma = condense_output_data(scaled_chroma, duration)
+    condensed_chroma.columns = chroma_columns
+
+    combined = pd.concat([condensed_mfcc, condensed_chroma], axis=1)
+    combined['tempo'] = tempo
+
+    return combined
+
+
+def output_features(audio_bytes, decode='librosa'):
+
+    y, sr = decode_audio(audio_bytes, decode)
+
+    return condense_output_features(*signal_features(y, sr))
@@ -0,0 +1,47 @@
+# Lean inference for the listening model. XGBClassifier.predict_proba on a
+# DataFrame converts it to a DMatrix and redoes its setup on every call.
+# XGBoostEngine keeps the booster and calls inplace_predict on a contiguous
+# float32 array with a fixed thread count, and takes the windows of many clips
+# in one call.
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class XGBoostEngine:
+
+    def __init__(self, model, n_threads=None):
+        # model is an XGBClassifier or a Booster. n_threads defaults to every
+        # core. Set it to 1 when several engines share the machine (e.g. one
+        # per worker process).
+        self.booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self.booster.set_param({'nthread': self.n_threads})
+        self.feature_names = self.booster.feature_names
+
+        # Same trees as predict_proba when the model was early-stopped
+        try:
+            best_iteration = model.best_iteration
+        except AttributeError:
+            best_iteration = None
+        self.iteration_range = (0, best_iteration + 1) if best_iteration is not None else (0, 0)
+
+    def _matrix(self, x):
+        # Columns are put in training order when x is a DataFrame with names
+        if isinstance(x, pd.DataFrame):
+            if self.feature_names is not None and list(x.columns) != self.feature_names:
+                x = x[self.feature_names]
+            x = x.to_numpy(np.float32)
+        return np.ascontiguousarray(x, dtype=np.float32)
+
+    def predict_proba(self, x):
+        return self.booster.inplace_predict(self._matrix(x), iteration_range=self.iteration_range,
+                                            validate_features=False)
+
+    def predict_many(self, frames):
+        # Probabilities for the windows of several clips from one call,
+        # split back out per clip
+        offsets = np.cumsum([0] + [len(frame) for frame in frames])
+        probs = self.predict_proba(np.concatenate([self._matrix(frame) for frame in frames]))
+        return [probs[offsets[n]:offsets[n + 1]] for n in range(len(frames))]
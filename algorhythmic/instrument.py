@@ -0,0 +1,275 @@
+# Per-stage timing for the prediction paths. Code marks its stages with
+# span() and its cache lookups with count(); each event goes to every
+# registered sink. With no sinks registered (the default) span() hands back a
+# shared no-op object and count() returns straight away, so the cost is one
+# list check.
+#
+# Sinks can be added in code with add_sink(), or from the environment with
+# configure_from_env():
+#   ALGORHYTHMIC_METRICS=ring,jsonl:/tmp/spans.jsonl,prom:/tmp/algorhythmic.prom
+#   ALGORHYTHMIC_PROFILE=cprofile:/tmp/profiles   (or tracemalloc:/tmp/profiles)
+import json
+import os
+import threading
+import time
+from collections import deque
+
+_sinks = []
+_profile = None
+
+
+class _NoSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.time()
+        self._perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event = {'type': 'span',
+                 'name': self.name,
+                 'start': self.start,
+                 'seconds': time.perf_counter() - self._perf_start,
+                 'error': exc_type.__name__ if exc_type else None}
+        if self.attrs:
+            event['attrs'] = self.attrs
+        _emit(event)
+        return False
+
+    def set(self, **attrs):
+        # For details only known inside the span, e.g. array sizes
+        self.attrs.update(attrs)
+
+
+def span(name, **attrs):
+    if not _sinks:
+        return _NO_SPAN
+    return _Span(name, attrs)
+
+
+def count(name, value=1):
+    if not _sinks:
+        return
+    _emit({'type': 'count', 'name': name, 'start': time.time(), 'value': value})
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def _emit(event):
+    for sink in _sinks:
+        sink.record(event)
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+class RingBufferSink:
+
+    # Keeps the last `size` events in memory
+    def __init__(self, size=10000):
+        self.events = deque(maxlen=size)
+
+    def record(self, event):
+        self.events.append(event)
+
+    def summary(self):
+        # Per span name: calls, total and max seconds. Per counter: total.
+        spans = {}
+        counts = {}
+        for event in list(self.events):
+            if event['type'] == 'span':
+                stats = spans.setdefault(event['name'], {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+                stats['calls'] += 1
+                stats['seconds'] += event['seconds']
+                stats['max_seconds'] = max(stats['max_seconds'], event['seconds'])
+            else:
+                counts[event['name']] = counts.get(event['name'], 0) + event['value']
+        return {'spans': spans, 'counts': counts}
+
+
+class JsonLinesSink:
+
+    # Appends every event to a JSON-lines file
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        line = json.dumps(event, default=str) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as file:
+                file.write(line)
+
+
+class PrometheusFileSink:
+
+    # Aggregates spans into per-stage histograms and counters, and rewrites a
+    # Prometheus text exposition file (e.g. for node_exporter's textfile
+    # collector) at most every `interval` seconds
+    BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+    def __init__(self, path, interval=5.0, prefix='algorhythmic'):
+        self.path = path
+        self.interval = interval
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self._written = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        with self._lock:
+            if event['type'] == 'span':
+                buckets, total = self.histograms.get(event['name'], ([0] * len(self.BUCKETS), [0, 0.0]))
+                for index, bound in enumerate(self.BUCKETS):
+                    if event['seconds'] <= bound:
+                        buckets[index] += 1
+                total[0] += 1
+                total[1] += event['seconds']
+                self.histograms[event['name']] = (buckets, total)
+            else:
+                self.counters[event['name']] = self.counters.get(event['name'], 0) + event['value']
+
+            if time.time() - self._written >= self.interval:
+                self.write()
+
+    def exposition(self):
+        lines = [f'# TYPE {self.prefix}_stage_seconds histogram']
+        for name, (buckets, (calls, seconds)) in sorted(self.histograms.items()):
+            for bound, bucket in zip(self.BUCKETS, buckets):
+                lines.append(f'{self.prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {bucket}')
+            lines.append(f'{self.prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {calls}')
+            lines.append(f'{self.prefix}_stage_seconds_sum{{stage="{name}"}} {seconds}')
+            lines.append(f'{self.prefix}_stage_seconds_count{{stage="{name}"}} {calls}')
+        lines.append(f'# TYPE {self.prefix}_events_total counter')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'{self.prefix}_events_total{{event="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(self.exposition())
+        os.replace(tmp_path, self.path)
+        self._written = time.time()
+
+
+# tracemalloc is process-wide, so overlapping tracemalloc captures share
+# one trace: the first to start turns it on and the last to finish turns it
+# off (unless it was already on). Their peaks cover each other's requests.
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False
+
+
+class _Profile:
+
+    # cProfile or tracemalloc capture of one request, saved under out_dir
+    def __init__(self, name, mode, out_dir):
+        self.name = name
+        self.mode = mode
+        self.out_dir = out_dir
+
+    def __enter__(self):
+        if self.mode == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            global _tracemalloc_users, _tracemalloc_owned
+            import tracemalloc
+            with _tracemalloc_lock:
+                if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start(25)
+                    _tracemalloc_owned = True
+                _tracemalloc_users += 1
+        return self
+
+    def __exit__(self, *exc):
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S') + f'-{time.time_ns() % 10 ** 9:09d}'
+        base = os.path.join(self.out_dir, f'{self.name}-{stamp}')
+        if self.mode == 'cprofile':
+            self.profiler.disable()
+            self.profiler.dump_stats(base + '.prof')
+        else:
+            global _tracemalloc_users, _tracemalloc_owned
+            import tracemalloc
+            with _tracemalloc_lock:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                _tracemalloc_users -= 1
+                if _tracemalloc_users == 0 and _tracemalloc_owned:
+                    tracemalloc.stop()
+                    _tracemalloc_owned = False
+            with open(base + '.txt', 'w') as file:
+                file.write(f'current {current} bytes, peak {peak} bytes\n')
+                for stat in snapshot.statistics('lineno')[:50]:
+                    file.write(f'{stat}\n')
+        return False
+
+
+def set_profile(mode=None, out_dir='./profiles/'):
+    # mode is None (off), 'cprofile' or 'tracemalloc'
+    global _profile
+    if mode not in (None, 'cprofile', 'tracemalloc'):
+        raise ValueError(f"Unknown profile mode: {mode}")
+    _profile = (mode, out_dir) if mode else None
+
+
+def profile_request(name):
+    if _profile is None:
+        return _NO_SPAN
+    return _Profile(name, *_profile)
+
+
+def configure_from_env(environ=os.environ):
+
+    # Sets up sinks and profiling from ALGORHYTHMIC_METRICS and
+    # ALGORHYTHMIC_PROFILE. Safe to call more than once, it only configures
+    # the first time anything is asked for.
+    if _sinks or _profile is not None:
+        return
+
+    for spec in filter(None, environ.get('ALGORHYTHMIC_METRICS', '').split(',')):
+        kind, _, target = spec.partition(':')
+        if kind == 'ring':
+            add_sink(RingBufferSink(int(target) if target else 10000))
+        elif kind == 'jsonl':
+            add_sink(JsonLinesSink(target))
+        elif kind == 'prom':
+            add_sink(PrometheusFileSink(target))
+        else:
+            raise ValueError(f"Unknown metrics sink: {spec}")
+
+    profile = environ.get('ALGORHYTHMIC_PROFILE')
+    if profile:
+        mode, _, out_dir = profile.partition(':')
+        set_profile(mode, out_dir or './profiles/')
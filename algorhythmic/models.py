@@ -0,0 +1,57 @@
+# Model loading. tensorflow and xgboost are imported here, on first use, so
+# that importing the rest of the package stays cheap.
+import hashlib
+import os
+
+SCRAPING_MODEL_PATH = './models/keras_2/'
+SCRAPING_DENSE_PATH = './models/scraping_dense.npz'
+LISTENING_MODEL_PATH = './models/new_xgb.h5'
+
+
+def load_scraping_model(path=None, engine=None):
+    # Set the model for Spotify Scraping. engine is 'keras' (the SavedModel)
+    # or 'numpy' (the export from algorhythmic.dense, no tensorflow needed),
+    # and defaults to ALGORHYTHMIC_SCRAPING_ENGINE or 'keras'.
+    engine = engine or os.environ.get('ALGORHYTHMIC_SCRAPING_ENGINE', 'keras')
+    if engine == 'numpy':
+        from .dense import DenseModel
+        return DenseModel.load(path or scraping_model_path(engine))
+    if engine != 'keras':
+        raise ValueError(f"Unknown scraping model engine: {engine}")
+
+    from tensorflow import keras
+    scrape_model = keras.models.load_model(path or scraping_model_path(engine))
+    return scrape_model
+
+
+def scraping_model_path(engine=None):
+    # The file load_scraping_model loads for an engine
+    engine = engine or os.environ.get('ALGORHYTHMIC_SCRAPING_ENGINE', 'keras')
+    return SCRAPING_DENSE_PATH if engine == 'numpy' else SCRAPING_MODEL_PATH
+
+
+def load_listening_model(path=LISTENING_MODEL_PATH):
+    # Set the model for listening
+    import xgboost as xgb
+    listen_model = xgb.XGBClassifier()
+    listen_model.load_model(path)
+    return listen_model
+
+
+def model_version(path):
+
+    # Changes whenever the model file (or any file of a SavedModel directory)
+    # is replaced: a hash of the files' sizes and modification times. None
+    # when there is no such file (e.g. the model is served from elsewhere).
+    if not os.path.exists(path):
+        return None
+    if os.path.isdir(path):
+        files = sorted(os.path.join(dirpath, name) for dirpath, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+
+    digest = hashlib.sha1()
+    for file in files:
+        info = os.stat(file)
+        digest.update(f'{os.path.relpath(file, path)}:{info.st_size}:{info.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()[:12]
@@ -0,0 +1,161 @@
+# Genre prediction and weighted-vote aggregation for both models
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from .features import (important_features,
+                       name_dict,
+                       decode_audio,
+                       signal_features,
+                       condense_output_features)
+from .instrument import span
+from .streaming import stream_output_features
+from .spotify import fetch_track_features
+
+
+# Points for a genre being a window's first, second and third guess
+VOTE_WEIGHTS = np.array([3, 2, 1])
+
+vote_columns = ['First Guess','Second Guess','Third Guess']
+
+
+def vote_points(probs):
+
+    # Every window votes for its three most likely genres, weighted 3/2/1.
+    # Returns the (n_genres, 3) points each genre got as first, second and
+    # third guess, which add up over windows.
+    probs = np.asarray(probs)
+    n_genres = probs.shape[1]
+
+    # Top 3 genres per window, then ordered most likely first
+    top_three = np.argpartition(probs, -3, axis=1)[:, -3:]
+    order = np.argsort(-np.take_along_axis(probs, top_three, axis=1), axis=1, kind='stable')
+    top_three = np.take_along_axis(top_three, order, axis=1)
+
+    # One bincount over (rank, genre) pairs gives the votes of every rank
+    rank_offsets = np.arange(3) * n_genres
+    counts = np.bincount((top_three + rank_offsets).ravel(), minlength=3 * n_genres)
+    return counts.reshape(3, n_genres).T * VOTE_WEIGHTS
+
+
+def votes_table(points, top=5):
+
+    # The top genres by weighted votes, from vote_points
+    total = points.sum(axis=1)
+
+    # Only genres that got any votes, most votes first (ties by genre index)
+    voted = np.flatnonzero(total)
+    best = voted[np.argsort(-total[voted], kind='stable')][:top]
+
+    new_df = pd.DataFrame(points[best].astype(float), columns=vote_columns,
+                          index=[name_dict[genre] for genre in best])
+    new_df['Weighted Votes'] = total[best].astype(float)
+
+    return new_df
+
+
+def weighted_votes(probs, top=5):
+    return votes_table(vote_points(probs), top)
+
+
+def predict_spotify(df, model):
+
+    # A plain float32 array is all model.predict needs, no tensorflow import
+    windows = df[important_features].to_numpy(np.float32)
+
+    with span('predict_spotify.inference', windows=len(windows)):
+        preds = model.predict(windows, verbose=0)
+
+    with span('predict_spotify.votes'):
+        return weighted_votes(preds)
+
+
+def predict_spotify_batch(sp, model, tracks, batch_size=50, max_workers=8, cache=None,
+                          store=None):
+
+    # Classify many tracks at once: the audio analyses of each batch of tracks
+    # are fetched concurrently, all of their 3 second windows go through a
+    # single model.predict call, and the votes are split back out per track.
+    # Returns (features, votes) for each track in order, or None if it failed.
+    # An AnalysisCache and/or FeatureStore can be passed to skip Spotify and
+    # the feature pipeline for tracks seen before.
+    results = []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for start in range(0, len(tracks), batch_size):
+            batch_dfs = list(pool.map(lambda track: fetch_track_features(sp, track, cache, store),
+                                      tracks[start:start + batch_size]))
+
+            found = [df for df in batch_dfs if df is not None and len(df) > 0]
+            if found:
+                windows = np.concatenate([df[important_features].to_numpy(np.float32)
+                                          for df in found])
+                preds = model.predict(windows, batch_size=len(windows), verbose=0)
+                offsets = np.cumsum([0] + [len(df) for df in found])
+
+            found_index = 0
+            for df in batch_dfs:
+                if df is None or len(df) == 0:
+                    results.append(None)
+                    continue
+                track_preds = preds[offsets[found_index]:offsets[found_index + 1]]
+                results.append((df, weighted_votes(track_preds)))
+                found_index += 1
+
+    return results
+
+
+def predict_output(model, audio_bytes, decode='librosa'):
+
+    with span('predict_output.decode', audio_bytes=len(audio_bytes)) as stage:
+        y, sr = decode_audio(audio_bytes, decode)
+        stage.set(samples=len(y), sr=sr)
+
+    with span('predict_output.features'):
+        signal = signal_features(y, sr)
+
+    with span('predict_output.condense') as stage:
+        combined = condense_output_features(*signal)
+        stage.set(windows=len(combined))
+
+    with span('predict_output.inference', windows=len(combined)):
+        pred_probs = model.predict_proba(combined)
+
+    with span('predict_output.votes'):
+        new_df = weighted_votes(pred_probs)
+
+    return combined, new_df
+
+
+def predict_output_batch(model, clips, decode='librosa'):
+
+    # predict_output for many recordings: features per clip, then all of
+    # their windows go through one predict_proba call. Returns (features,
+    # votes) for each clip in order.
+    frames = []
+    for audio_bytes in clips:
+        with span('predict_output.features', audio_bytes=len(audio_bytes)):
+            frames.append(condense_output_features(*signal_features(*decode_audio(audio_bytes, decode))))
+
+    with span('predict_output.inference', clips=len(frames)):
+        pred_probs = model.predict_proba(pd.concat(frames, ignore_index=True))
+    offsets = np.cumsum([0] + [len(frame) for frame in frames])
+
+    return [(frame, weighted_votes(pred_probs[offsets[n]:offsets[n + 1]]))
+            for n, frame in enumerate(frames)]
+
+
+def predict_output_stream(model, audio):
+
+    # Streaming predict_output for long recordings: yields (row, votes) after
+    # every 3 second window, where row is that window's features and votes is
+    # the weighted vote over all windows so far. The vote points are a running
+    # sum, so each window costs the same however long the recording is.
+    points = None
+
+    for row in stream_output_features(audio):
+        window_points = vote_points(model.predict_proba(row))
+        points = window_points if points is None else points + window_points
+
+        yield row, votes_table(points)
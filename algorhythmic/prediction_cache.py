@@ -0,0 +1,117 @@
+# In-process memo of predict_output, for the same recording evaluated again
+# (every button press reruns the page). Entries are keyed by a hash of the
+# audio bytes, the model and FEATURE_PIPELINE_VERSION, and hold both the
+# feature frame and the vote table. The least recently used entries are
+# dropped once their total size passes max_bytes.
+#
+# One cache is meant to be shared by every session in the process. Hits and
+# misses go to the metrics as prediction_cache.hit / .miss / .evict.
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .features import FEATURE_PIPELINE_VERSION
+from .instrument import count
+from .predict import predict_output
+
+
+def frame_bytes(df):
+    # DataFrame or Series
+    return int(np.sum(df.memory_usage(index=True, deep=True)))
+
+
+def model_key(model):
+    # Models served by name (the registry's LazyModel, RemoteModel) are keyed
+    # by it and the version of what is loaded under it, so a replaced model
+    # file gets new entries. Anything else by identity, which holds for as
+    # long as the model is loaded, i.e. for cached resources.
+    name = getattr(model, 'name', None)
+    version = getattr(model, 'model_version', None)
+    if isinstance(name, str) and version is not None:
+        return f'{name}@{version}'
+    return f'{type(model).__name__}-{id(model)}'
+
+
+class PredictionCache:
+
+    def __init__(self, max_bytes=64 * 1024 ** 2, version=FEATURE_PIPELINE_VERSION):
+        self.max_bytes = max_bytes
+        self.version = version
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, model, audio_bytes, decode='librosa'):
+        digest = hashlib.sha1(audio_bytes).hexdigest()
+        return f'v{self.version}:{model_key(model)}:{decode}:{digest}'
+
+    def get(self, key):
+
+        # (features, votes) or None. Copies, so callers can't change the entry.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        count('prediction_cache.miss' if entry is None else 'prediction_cache.hit')
+
+        if entry is None:
+            return None
+        features, votes, _ = entry
+        return features.copy(), votes.copy()
+
+    def put(self, key, features, votes):
+
+        size = frame_bytes(features) + frame_bytes(votes)
+        if size > self.max_bytes:
+            return
+
+        evicted = 0
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (features.copy(), votes.copy(), size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, dropped) = self._entries.popitem(last=False)
+                self.bytes -= dropped
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            count('prediction_cache.evict', evicted)
+
+    def predict_output(self, model, audio_bytes, decode='librosa'):
+        # predict_output, answered from the cache when this recording has been
+        # through the same model and pipeline before
+        key = self.key(model, audio_bytes, decode)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        features, votes = predict_output(model, audio_bytes, decode)
+        self.put(key, features, votes)
+        return features, votes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,266 @@
+# Offline genre -> candidate tracks index, so recommendations need no
+# network I/O. The index is a directory of flat arrays that are memory-mapped
+# on load:
+#   strings.bin        every record's fields as concatenated utf-8
+#   fields.npy         (n_records, 5) uint32 field boundaries into strings.bin
+#                      (name, artist, preview URL, image URL)
+#   genre_offsets.npy  records are grouped by genre index (see name_dict),
+#                      genre g's records are rows genre_offsets[g]:genre_offsets[g + 1]
+#   meta.json          when and from what the index was built
+#
+# Each build is its own subdirectory of the index directory, and a CURRENT
+# file there names the one in use:
+#   models/rec_index/CURRENT           "build-abc123"
+#   models/rec_index/build-abc123/     the files above
+# A rebuild writes a new subdirectory, replaces CURRENT in one rename and then
+# deletes the old build, so there is always a complete index to open and an
+# app that has the old files mapped keeps reading them intact. index_version
+# changes with every build, for reloading. (An index directory from before
+# this layout, with the files directly in it, still loads.)
+#
+# Refresh it with:
+#   python -m algorhythmic.rec_index --from-api --out ./models/rec_index/
+#   python -m algorhythmic.rec_index --from-csv ./data/ --out ./models/rec_index/
+# --from-api reads CLIENT_ID and CLIENT_SECRET from the environment.
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from .features import name_dict
+
+RECORD_FIELDS = ['track', 'artist', 'url', 'image']
+
+genre_index = {genre: index for index, genre in name_dict.items()}
+
+
+def current_build(index_dir):
+    # The directory of the build CURRENT names, or index_dir itself for the
+    # old layout
+    try:
+        with open(os.path.join(index_dir, 'CURRENT')) as file:
+            return os.path.join(index_dir, file.read().strip())
+    except FileNotFoundError:
+        return index_dir
+
+
+def read_build(index_dir, read):
+
+    # read(opener) with an opener for the files of the current build. A
+    # rebuild can delete that build while it's being read, in which case
+    # CURRENT has moved on and the new build is read instead.
+    while True:
+        build_dir = current_build(index_dir)
+        try:
+            dir_fd = os.open(build_dir, os.O_RDONLY)
+            try:
+                return read(lambda path, flags: os.open(path, flags, dir_fd=dir_fd))
+            finally:
+                os.close(dir_fd)
+        except FileNotFoundError:
+            if current_build(index_dir) == build_dir:
+                raise
+
+
+def map_npy(file):
+    # np.load(mmap_mode='r') for an open file, which np.load only takes a path for
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+    return np.memmap(file, dtype=dtype, mode='r', shape=shape, offset=file.tell(),
+                     order='F' if fortran_order else 'C')
+
+
+class RecommendationIndex:
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+
+        # Every file is opened through one handle on the build's directory, so
+        # all of them come from the same build
+        read_build(index_dir, self._read)
+
+    def _read(self, opener):
+        with open('strings.bin', 'rb', opener=opener) as file:
+            self.strings = np.memmap(file, dtype=np.uint8, mode='r')
+        with open('fields.npy', 'rb', opener=opener) as file:
+            self.fields = map_npy(file)
+        with open('genre_offsets.npy', 'rb', opener=opener) as file:
+            self.genre_offsets = np.load(file)
+        with open('meta.json', opener=opener) as file:
+            self.meta = json.load(file)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def candidates(self, genre):
+        index = genre_index[genre] if isinstance(genre, str) else genre
+        return int(self.genre_offsets[index + 1] - self.genre_offsets[index])
+
+    def record(self, row):
+        bounds = self.fields[row]
+        values = [bytes(self.strings[bounds[n]:bounds[n + 1]]).decode() for n in range(4)]
+        return {field: value or None for field, value in zip(RECORD_FIELDS, values)}
+
+    def sample(self, genre, rng):
+        index = genre_index[genre] if isinstance(genre, str) else genre
+        start, end = self.genre_offsets[index], self.genre_offsets[index + 1]
+        if start == end:
+            return None
+        return self.record(int(rng.integers(start, end)))
+
+    def recommend(self, genre_list, seed=None):
+        # Same records as pick_recommendations, with no network I/O. Genres
+        # without candidates are skipped.
+        rng = np.random.default_rng(seed)
+        recs = [self.sample(genre, rng) for genre in genre_list]
+        return [rec for rec in recs if rec is not None]
+
+
+def build_index(index_dir, genre_tracks, source=''):
+
+    # genre_tracks maps a genre (name or index) to a list of records with the
+    # RECORD_FIELDS keys
+    by_index = {}
+    for genre, records in genre_tracks.items():
+        index = genre_index[genre] if isinstance(genre, str) else genre
+        by_index.setdefault(index, []).extend(records)
+
+    blob = bytearray()
+    fields = []
+    genre_offsets = [0]
+    for index in range(len(name_dict)):
+        for record in by_index.get(index, []):
+            bounds = [len(blob)]
+            for field in RECORD_FIELDS:
+                blob += (record.get(field) or '').encode()
+                bounds.append(len(blob))
+            fields.append(bounds)
+        genre_offsets.append(len(fields))
+
+    # Never write over the files a running app has mapped: build in a new
+    # subdirectory, point CURRENT at it with one rename, then delete the
+    # other builds (mappings of deleted files stay valid)
+    os.makedirs(index_dir, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=index_dir, prefix='build-')
+    build = os.path.basename(build_dir)
+    with open(os.path.join(build_dir, 'strings.bin'), 'wb') as file:
+        file.write(bytes(blob))
+    np.save(os.path.join(build_dir, 'fields.npy'), np.array(fields, dtype=np.uint32).reshape(-1, 5))
+    np.save(os.path.join(build_dir, 'genre_offsets.npy'), np.array(genre_offsets, dtype=np.int64))
+    with open(os.path.join(build_dir, 'meta.json'), 'w') as file:
+        json.dump({'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'build_id': build,
+                   'source': source,
+                   'records': len(fields)}, file)
+    os.chmod(build_dir, 0o755)
+
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix='CURRENT.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        file.write(build + '\n')
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, os.path.join(index_dir, 'CURRENT'))
+
+    # Earlier builds, including files of the old layout and builds that never
+    # finished
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if name.startswith('build-') and name != build:
+            shutil.rmtree(path, ignore_errors=True)
+        elif name in ('strings.bin', 'fields.npy', 'genre_offsets.npy', 'meta.json'):
+            os.remove(path)
+
+    return RecommendationIndex(index_dir)
+
+
+def index_version(index_dir):
+
+    # Changes with every build, None when there is no index
+    def read(opener):
+        with open('meta.json', opener=opener) as file:
+            return json.load(file)
+
+    try:
+        meta = read_build(index_dir, read)
+    except (FileNotFoundError, ValueError):
+        return None
+    return meta.get('build_id') or meta.get('built_at')
+
+
+def tracks_from_api(sp, max_workers=5):
+
+    # The same searches the live recommendations use, for all 50 genres
+    from .spotify import genre_pool
+    from concurrent.futures import ThreadPoolExecutor
+
+    genres = list(name_dict.values())
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pools = list(pool.map(lambda genre: genre_pool(sp, genre, pools=None), genres))
+
+    genre_tracks = {}
+    for genre, items in zip(genres, pools):
+        genre_tracks[genre] = [{'track': item['name'],
+                                'artist': item['artists'][0]['name'],
+                                'url': item.get('preview_url'),
+                                'image': item['album']['images'][1]['url']
+                                if len(item['album']['images']) > 1 else None}
+                               for item in items]
+
+    return genre_tracks
+
+
+def tracks_from_csvs(data_dir):
+
+    # The training songs (see the EDA page) as candidates, one per title.
+    # They have no preview or image URLs.
+    import pandas as pd
+
+    csv_files = [file for file in os.listdir(data_dir) if file.endswith('.csv')]
+    df = pd.concat([pd.read_csv(os.path.join(data_dir, file), usecols=['title', 'artist', 'genre'])
+                    for file in csv_files], ignore_index=True)
+    df = df.drop_duplicates(subset='title', keep='first')
+
+    genre_tracks = {}
+    for genre, group in df.groupby('genre'):
+        if genre not in genre_index:
+            continue
+        genre_tracks[genre] = [{'track': str(title), 'artist': str(artist)}
+                               for title, artist in zip(group['title'], group['artist'])]
+
+    return genre_tracks
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Rebuild the recommendation index')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--from-api', action='store_true')
+    source.add_argument('--from-csv', metavar='DATA_DIR')
+    parser.add_argument('--out', default='./models/rec_index/')
+    args = parser.parse_args()
+
+    if args.from_api:
+        import spotipy
+        from spotipy.oauth2 import SpotifyClientCredentials
+        client_credentials_manager = SpotifyClientCredentials(client_id=os.environ['CLIENT_ID'],
+                                                              client_secret=os.environ['CLIENT_SECRET'])
+        sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+        genre_tracks = tracks_from_api(sp)
+        source_name = 'spotify search'
+    else:
+        genre_tracks = tracks_from_csvs(args.from_csv)
+        source_name = f'csv:{args.from_csv}'
+
+    index = build_index(args.out, genre_tracks, source_name)
+    print(f"Built {len(index)} records for "
+          f"{sum(index.candidates(g) > 0 for g in range(len(name_dict)))} genres in {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# Models loaded in the background. ModelRegistry.start loads every
+# registered model on its own thread, then warms it up with one prediction on
+# dummy windows so tensorflow's graph tracing etc. is done before the first
+# real request. Until then, anything that needs a model blocks in get (or in
+# LazyModel.predict), and everything else can go ahead.
+#
+#   registry = ModelRegistry()
+#   registry.register('listening', lambda: XGBoostEngine(load_listening_model()), 49)
+#   registry.start()
+#   model = registry.model('listening')   # returns at once
+#   model.predict_proba(windows)          # waits for the load if needed
+#
+# stats() has the state of each model and its load and warm-up timings.
+import threading
+import time
+
+import numpy as np
+
+from .instrument import span
+
+
+class ModelRegistry:
+
+    def __init__(self):
+        self._entries = {}
+        self._started = False
+
+    def register(self, name, load, n_features=None, version=None):
+        # load is called with no arguments on the loading thread. n_features
+        # is the width of the dummy windows for the warm-up, None skips it.
+        # version is called just before load and names what it loads (e.g.
+        # models.model_version of the file), for keying caches on.
+        if self._started:
+            raise RuntimeError("Register models before starting the registry")
+        self._entries[name] = {'load': load,
+                               'n_features': n_features,
+                               'version': version,
+                               'ready': threading.Event(),
+                               'state': 'registered',
+                               'model': None,
+                               'error': None,
+                               'timings': {}}
+
+    def start(self):
+        if self._started:
+            return self
+        self._started = True
+        self.started = time.time()
+        for name in self._entries:
+            threading.Thread(target=self._load, args=(name,), name=f'load-{name}', daemon=True).start()
+        return self
+
+    def _load(self, name):
+
+        entry = self._entries[name]
+        try:
+            entry['state'] = 'loading'
+            if entry['version'] is not None:
+                entry['version'] = entry['version']()
+            start = time.perf_counter()
+            with span('registry.load', model=name):
+                model = entry['load']()
+            entry['timings']['load_seconds'] = time.perf_counter() - start
+
+            if entry['n_features']:
+                entry['state'] = 'warming up'
+                start = time.perf_counter()
+                with span('registry.warmup', model=name):
+                    warm_up(model, entry['n_features'])
+                entry['timings']['warmup_seconds'] = time.perf_counter() - start
+
+            entry['model'] = model
+            entry['state'] = 'ready'
+        except Exception as error:
+            entry['error'] = error
+            entry['state'] = 'failed'
+        finally:
+            entry['ready'].set()
+
+    def ready(self, name):
+        return self._entries[name]['ready'].is_set()
+
+    def get(self, name, timeout=None):
+
+        # The loaded model, waiting up to timeout seconds (forever by default).
+        # Raises the loader's exception if loading failed.
+        entry = self._entries[name]
+        if not self._started:
+            raise RuntimeError("The registry hasn't been started")
+        if not entry['ready'].wait(timeout):
+            raise TimeoutError(f"{name} model still {entry['state']} after {timeout}s")
+        if entry['error'] is not None:
+            raise entry['error']
+        return entry['model']
+
+    def version(self, name, timeout=None):
+
+        # Which model was loaded, waiting for it like get. A model that knows
+        # its own version (RemoteModel) has the last word. Without either, the
+        # loaded object's identity, which holds until the process exits.
+        model = self.get(name, timeout)
+        version = getattr(model, 'model_version', None) or self._entries[name]['version']
+        return version or f'{type(model).__name__}-{id(model)}'
+
+    def model(self, name):
+        return LazyModel(self, name)
+
+    def stats(self):
+        return {name: {'state': entry['state'],
+                       **entry['timings'],
+                       **({'error': f"{type(entry['error']).__name__}: {entry['error']}"}
+                          if entry['error'] is not None else {})}
+                for name, entry in self._entries.items()}
+
+
+def warm_up(model, n_features):
+    # One prediction on a window of zeros, through whichever call the model has
+    x = np.zeros((1, n_features), dtype=np.float32)
+    if hasattr(model, 'predict_proba'):
+        model.predict_proba(x)
+    else:
+        model.predict(x, verbose=0)
+
+
+class LazyModel:
+
+    # Stands in for a model that may still be loading. predict_spotify,
+    # predict_output and friends only call predict / predict_proba, which
+    # block until the registry has it.
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def ready(self):
+        return self.registry.ready(self.name)
+
+    @property
+    def model_version(self):
+        return self.registry.version(self.name)
+
+    def predict(self, x, **kwargs):
+        return self.registry.get(self.name).predict(x, **kwargs)
+
+    def predict_proba(self, x):
+        return self.registry.get(self.name).predict_proba(x)
+
+    def __getattr__(self, attr):
+        # Anything else (predict_many etc.) from the loaded model
+        if attr.startswith('__') or attr in ('registry', 'name'):
+            raise AttributeError(attr)
+        return getattr(self.registry.get(self.name), attr)
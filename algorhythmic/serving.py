@@ -0,0 +1,328 @@
+# Local inference service: one process keeps both models loaded and warm,
+# and the Streamlit pages send it window matrices instead of loading
+# tensorflow and xgboost themselves. Requests from all connections go through
+# a MicroBatcher per model, so concurrent sessions share model calls.
+#
+#   python -m algorhythmic.serving [--port 6150] [--max-wait-ms 5] [--stand-in]
+#
+# The pages use it when ALGORHYTHMIC_MODEL_SERVER is set, e.g.
+#   ALGORHYTHMIC_MODEL_SERVER=127.0.0.1:6150
+# Connections are multiprocessing.connection sockets on localhost, and
+# requests are unpickled, so the authkey is what keeps other local users out.
+# It comes from ALGORHYTHMIC_MODEL_SERVER_KEY, or else from a key file
+# (ALGORHYTHMIC_MODEL_SERVER_KEY_FILE, default ./cache/model_server.key) that
+# the server creates with a random key, readable by its owner only.
+import argparse
+import os
+import queue
+import secrets
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import pandas as pd
+
+from .batching import MicroBatcher, keras_predictor
+from .features import chroma_columns, important_features, mfcc_columns
+from .inference import XGBoostEngine
+
+DEFAULT_ADDRESS = ('127.0.0.1', 6150)
+DEFAULT_KEY_PATH = './cache/model_server.key'
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+# Input columns in the order the models were trained on, and their widths
+# for the warm-up call and for checking requests
+MODEL_COLUMNS = {'scraping': important_features,
+                 'listening': mfcc_columns + chroma_columns + ['tempo']}
+MODEL_FEATURES = {name: len(columns) for name, columns in MODEL_COLUMNS.items()}
+
+
+def parse_address(address):
+    if isinstance(address, tuple):
+        return address
+    host, _, port = address.rpartition(':')
+    return host or DEFAULT_ADDRESS[0], int(port)
+
+
+def authkey(environ=os.environ, create=False):
+
+    # The key from the environment, else from the key file. With create (the
+    # server), a missing key file is made with a new random key.
+    key = environ.get('ALGORHYTHMIC_MODEL_SERVER_KEY')
+    if key:
+        return key.encode()
+
+    path = environ.get('ALGORHYTHMIC_MODEL_SERVER_KEY_FILE', DEFAULT_KEY_PATH)
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as file:
+                file.write(secrets.token_hex(32))
+
+    try:
+        with open(path) as file:
+            mode = os.fstat(file.fileno()).st_mode
+            key = file.read().strip()
+    except FileNotFoundError:
+        raise RuntimeError(f"No model server key: set ALGORHYTHMIC_MODEL_SERVER_KEY or start "
+                           f"the server to create {path}") from None
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise RuntimeError(f"{path} is readable by other users, chmod 600 it")
+    if not key:
+        raise RuntimeError(f"{path} is empty")
+    return key.encode()
+
+
+def model_predictors(models):
+
+    # Keras and XGBoost take the same float32 matrix with different calls.
+    # Keras models are called directly (see keras_predictor) and XGBoost
+    # through inplace_predict (see XGBoostEngine).
+    predictors = {}
+    for name, model in models.items():
+        if name == 'scraping' and hasattr(model, 'layers'):
+            predictors[name] = keras_predictor(model, MODEL_FEATURES[name])
+        elif name == 'scraping':
+            predictors[name] = lambda x, model=model: model.predict(x, batch_size=len(x), verbose=0)
+        elif hasattr(model, 'get_booster'):
+            predictors[name] = XGBoostEngine(model).predict_proba
+        else:
+            predictors[name] = model.predict_proba
+    return predictors
+
+
+class ModelServer:
+
+    def __init__(self, models, address=DEFAULT_ADDRESS, key=None, max_batch=4096, max_wait=0.005,
+                 versions=None):
+        host, port = parse_address(address)
+        if host not in LOCAL_HOSTS:
+            raise ValueError(f"The model server only listens on localhost, not {host}")
+
+        # Which file each model came from (see model_versions), for clients
+        # to key caches on
+        self.versions = versions or {}
+        self.started = time.time()
+        self.timings = {}
+        self.batchers = {}
+        for name, predict in model_predictors(models).items():
+            # One call on dummy windows so graph tracing etc. happens now
+            start = time.perf_counter()
+            predict(np.zeros((1, MODEL_FEATURES[name]), dtype=np.float32))
+            self.timings[f'{name}_warmup_seconds'] = time.perf_counter() - start
+            self.batchers[name] = MicroBatcher(predict, max_batch, max_wait, name=f'serving.{name}')
+
+        self.listener = Listener((host, port), backlog=128, authkey=key or authkey(create=True))
+        self.address = self.listener.address
+        self._closed = False
+
+    def serve_forever(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                # Closed, or a client that failed the authkey handshake
+                if self._closed:
+                    break
+                continue
+            threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        self.listener.close()
+        for batcher in self.batchers.values():
+            batcher.close()
+
+    def stats(self):
+        return {'uptime_seconds': time.time() - self.started,
+                'versions': self.versions,
+                **self.timings,
+                **{name: batcher.stats() for name, batcher in self.batchers.items()}}
+
+    def _handle(self, connection):
+
+        # Requests are (request_id, model_name, windows). Replies are
+        # (request_id, 'ok', predictions) or (request_id, 'error', message) and
+        # may come back out of order when a client pipelines requests. They
+        # are sent by a writer thread, so a slow client never holds up the
+        # batcher threads that finish its requests.
+        replies = queue.Queue()
+        reply = replies.put
+
+        def write():
+            while True:
+                message = replies.get()
+                if message is None:
+                    break
+                try:
+                    connection.send(message)
+                except OSError:
+                    pass
+
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+
+        def on_done(request_id, future):
+            try:
+                reply((request_id, 'ok', np.asarray(future.result(), dtype=np.float32)))
+            except Exception as error:
+                reply((request_id, 'error', f'{type(error).__name__}: {error}'))
+
+        with connection:
+            while True:
+                try:
+                    request_id, name, windows = connection.recv()
+                except (EOFError, OSError):
+                    break
+
+                if name == 'stats':
+                    reply((request_id, 'ok', self.stats()))
+                    continue
+                if name not in self.batchers:
+                    reply((request_id, 'error', f'Unknown model: {name}'))
+                    continue
+                windows = np.asarray(windows, dtype=np.float32)
+                if windows.ndim != 2 or windows.shape[1] != MODEL_FEATURES[name]:
+                    reply((request_id, 'error', f'{name} takes (n, {MODEL_FEATURES[name]}) windows, '
+                                                f'got {windows.shape}'))
+                    continue
+
+                future = self.batchers[name].submit(windows)
+                future.add_done_callback(lambda future, request_id=request_id: on_done(request_id, future))
+
+            # The client is gone, replies still due are dropped
+            reply(None)
+            writer.join()
+
+
+class ModelClient:
+
+    # One connection per thread, so Streamlit sessions don't queue behind
+    # each other's sends
+    def __init__(self, address=DEFAULT_ADDRESS, key=None, timeout=30.0):
+        self.address = parse_address(address)
+        self.key = key or authkey()
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = Client(self.address, authkey=self.key)
+        return connection
+
+    def _call(self, name, windows):
+        connection = self._connection()
+        try:
+            connection.send((0, name, windows))
+            if not connection.poll(self.timeout):
+                raise TimeoutError(f"No reply from the model server at {self.address}")
+            _, status, value = connection.recv()
+        except (OSError, EOFError, TimeoutError):
+            # Reconnect on the next call
+            self._local.connection = None
+            connection.close()
+            raise
+        if status == 'error':
+            raise RuntimeError(value)
+        return value
+
+    def predict(self, name, windows):
+        return self._call(name, np.asarray(windows, dtype=np.float32))
+
+    def stats(self):
+        return self._call('stats', None)
+
+
+class RemoteModel:
+
+    # Stands in for the loaded model in predict_spotify, predict_output and
+    # friends, which only call predict / predict_proba
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def _windows(self, x):
+        # Columns are put in training order when x is a DataFrame, the server
+        # only sees the matrix
+        if isinstance(x, pd.DataFrame):
+            x = x[MODEL_COLUMNS[self.name]]
+        return x
+
+    def predict(self, x, **kwargs):
+        return self.client.predict(self.name, self._windows(x))
+
+    def predict_proba(self, x):
+        return self.client.predict(self.name, self._windows(x))
+
+    @property
+    def model_version(self):
+        # Asked every time, so a server restarted on a new model file is seen
+        return self.client.stats()['versions'].get(self.name)
+
+
+def remote_model(name, environ=os.environ):
+    # A RemoteModel when ALGORHYTHMIC_MODEL_SERVER is set, otherwise None
+    address = environ.get('ALGORHYTHMIC_MODEL_SERVER')
+    if not address:
+        return None
+    return RemoteModel(ModelClient(address, authkey(environ)), name)
+
+
+def load_models(stand_in=False):
+
+    from .models import load_listening_model, load_scraping_model
+    from .stub import StandInModel
+
+    if stand_in:
+        return {name: StandInModel(n_features) for name, n_features in MODEL_FEATURES.items()}
+    return {'scraping': load_scraping_model(), 'listening': load_listening_model()}
+
+
+def model_versions(stand_in=False):
+
+    from .models import LISTENING_MODEL_PATH, model_version, scraping_model_path
+
+    if stand_in:
+        return dict.fromkeys(MODEL_FEATURES, 'stand-in')
+    return {'scraping': model_version(scraping_model_path()),
+            'listening': model_version(LISTENING_MODEL_PATH)}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Serve both models on localhost')
+    parser.add_argument('--host', default=DEFAULT_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument('--max-batch', type=int, default=4096, help='rows per model call')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='how long a request waits for others to batch with')
+    parser.add_argument('--stand-in', action='store_true',
+                        help='serve random stand-in models (for load testing)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    versions = model_versions(args.stand_in)
+    models = load_models(args.stand_in)
+    load_seconds = time.perf_counter() - start
+
+    server = ModelServer(models, (args.host, args.port), max_batch=args.max_batch,
+                         max_wait=args.max_wait_ms / 1000, versions=versions)
+    server.timings['load_seconds'] = load_seconds
+    print(f"Serving {', '.join(server.batchers)} on {server.address[0]}:{server.address[1]} "
+          f"(loaded in {load_seconds:.1f}s)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
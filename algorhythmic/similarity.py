@@ -0,0 +1,306 @@
+# Nearest-neighbour search over songs by how they sound. Each song is one
+# vector: the mean of its condensed 3 second windows over important_features,
+# standardised with the catalog's mean and spread so tempo doesn't swamp the
+# 0-1 features. Search is exact (one BLAS matrix product over the whole
+# catalog) or approximate with an IVF index (k-means lists, only the n_probe
+# closest lists are scanned).
+#
+# Build it from the training CSVs with:
+#   python -m algorhythmic.similarity --from-csv ./data/ --out ./models/similarity/
+#
+# Songs added to a loaded index (add_song) are also appended to added.jsonl
+# in its directory, and replayed by the next load.
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .clustering import kmeans, nearest, squared_distances
+from .features import important_features
+
+RECORD_FIELDS = ['title', 'artist', 'genre', 'track_id']
+
+
+def song_vector(df):
+
+    # Mean window over important_features. Features the frame doesn't have
+    # (e.g. the Spotify loudness columns for a recorded clip) are NaN and
+    # are left out of the distance.
+    means = df.reindex(columns=important_features).astype(np.float64).mean(axis=0)
+    return means.to_numpy(np.float32)
+
+
+def catalog_vectors(full_df):
+
+    # One vector per (title, artist) from a frame of windows like make_full_df's
+    grouped = full_df.groupby(['title', 'artist'], sort=False)
+    vectors = grouped[important_features].mean().astype(np.float32)
+    genres = grouped['genre'].first() if 'genre' in full_df else None
+
+    records = [{'title': str(title), 'artist': str(artist),
+                'genre': str(genres[(title, artist)]) if genres is not None else None,
+                'track_id': None}
+               for title, artist in vectors.index]
+
+    return vectors.to_numpy(), records
+
+
+class SimilarityIndex:
+
+    def __init__(self, vectors, records, center=None, scale=None):
+        vectors = np.asarray(vectors, dtype=np.float32)
+
+        # Standardisation is fixed when the index is built, so songs added
+        # later land in the same space
+        if center is None:
+            center = np.nanmean(vectors, axis=0)
+            scale = np.nanstd(vectors, axis=0)
+            scale[~(scale > 0)] = 1
+        self.center = np.asarray(center, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+        self.vectors = np.nan_to_num((vectors - self.center) / self.scale)
+        self.records = list(records)
+        self._keys = {self._key(record) for record in self.records}
+        self._norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        self._lock = threading.Lock()
+        self.index_dir = None
+
+        self.centroids = None
+        self.assignments = None
+        self._lists = None
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def _key(record):
+        return (str(record.get('title')).lower(), str(record.get('artist')).lower())
+
+    def standardise(self, vectors):
+        return (np.asarray(vectors, dtype=np.float32) - self.center) / self.scale
+
+    def add(self, vectors, records, save=False):
+
+        # Incremental insert, songs already in the index are skipped. With
+        # save, the new songs are also appended to the index directory's log.
+        vectors = np.atleast_2d(vectors)
+
+        with self._lock:
+            keep = []
+            for row, record in enumerate(records):
+                key = self._key(record)
+                if key not in self._keys:
+                    self._keys.add(key)
+                    keep.append(row)
+            if not keep:
+                return 0
+
+            # New arrays rather than in-place changes, so a search holding
+            # the old ones (see _snapshot) stays consistent
+            new_vectors = np.nan_to_num(self.standardise(vectors[keep]))
+            self.vectors = np.concatenate([self.vectors, new_vectors])
+            self._norms = np.concatenate([self._norms, np.einsum('ij,ij->i', new_vectors, new_vectors)])
+            self.records.extend(records[row] for row in keep)
+
+            if self.centroids is not None:
+                self.assignments = np.concatenate([self.assignments,
+                                                   nearest(new_vectors, self.centroids)])
+                self._lists = None
+
+            if save and self.index_dir is not None:
+                with open(os.path.join(self.index_dir, 'added.jsonl'), 'a') as file:
+                    for row in keep:
+                        file.write(json.dumps({'vector': vectors[row].tolist(),
+                                               'record': records[row]}) + '\n')
+
+        return len(keep)
+
+    def add_song(self, df, record, save=True):
+        # A classified track's windows (e.g. from get_spotify_df)
+        return self.add(song_vector(df)[None, :], [record], save)
+
+    def train_ivf(self, n_lists=None, iterations=20, seed=0):
+        n_lists = n_lists or max(1, int(np.sqrt(len(self))))
+        with self._lock:
+            vectors = self.vectors
+        centroids, _ = kmeans(vectors, n_lists, iterations, seed)
+        with self._lock:
+            # Songs added while training are assigned too
+            self.centroids = centroids
+            self.assignments = nearest(self.vectors, centroids)
+            self._lists = None
+
+    def _snapshot(self):
+
+        # Everything a search reads, taken together under the lock so a
+        # concurrent add can't leave vectors and norms out of step
+        with self._lock:
+            ivf = None
+            if self.centroids is not None:
+                if self._lists is None:
+                    order = np.argsort(self.assignments, kind='stable')
+                    offsets = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+                    self._lists = (order, offsets)
+                ivf = (self.centroids, *self._lists)
+            return self.vectors, self._norms, ivf
+
+    def search(self, query, k=5, mode='exact', n_probe=4):
+
+        # query is a song vector (or a (n, d) array of them) in the raw
+        # feature space. Returns (rows, distances) of shape (n, k), padded
+        # with row -1 at distance inf when fewer than k songs are found.
+        queries = self.standardise(np.atleast_2d(query))
+        vectors, norms, ivf = self._snapshot()
+
+        # Leave features the query doesn't have out of the distance
+        mask = np.isfinite(queries).all(axis=0)
+        queries = queries[:, mask]
+        if not mask.all():
+            vectors = vectors[:, mask]
+            norms = None
+
+        if mode == 'ivf' and ivf is not None:
+            return self._search_ivf(queries, vectors, mask, ivf, k, n_probe)
+
+        distances = squared_distances(queries, vectors, norms)
+        return self._top_k(distances, np.arange(len(vectors)), k)
+
+    def _search_ivf(self, queries, vectors, mask, ivf, k, n_probe):
+        centroids, order, offsets = ivf
+        list_distances = squared_distances(queries, centroids[:, mask])
+        list_sizes = np.diff(offsets)
+
+        rows = []
+        distances = []
+        for query, lists in zip(queries, np.argsort(list_distances, axis=1)):
+            # The n_probe closest lists, and further ones until they hold k
+            # songs between them (small or empty lists can leave fewer)
+            enough = np.searchsorted(np.cumsum(list_sizes[lists]), k) + 1
+            lists = lists[:max(n_probe, enough)]
+            candidates = np.concatenate([order[offsets[n]:offsets[n + 1]] for n in lists])
+            candidate_distances = squared_distances(query[None, :], vectors[candidates])
+            top_rows, top_distances = self._top_k(candidate_distances, candidates, k)
+            rows.append(top_rows[0])
+            distances.append(top_distances[0])
+
+        return np.array(rows), np.array(distances)
+
+    @staticmethod
+    def _top_k(distances, candidates, k):
+
+        # Rows and distances of shape (n, k), sorted by distance. With fewer
+        # than k candidates the rest is padded with row -1 at distance inf.
+        n, n_candidates = distances.shape
+        rows = np.full((n, k), -1)
+        top_distances = np.full((n, k), np.inf)
+        found = min(k, n_candidates)
+        if found == 0:
+            return rows, top_distances
+
+        top = np.argpartition(distances, found - 1, axis=1)[:, :found]
+        order = np.argsort(np.take_along_axis(distances, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        rows[:, :found] = candidates[top]
+        top_distances[:, :found] = np.sqrt(np.take_along_axis(distances, top, axis=1))
+        return rows, top_distances
+
+    def similar_songs(self, df, k=5, mode='exact', exclude=None):
+
+        # The k most similar songs to a track or clip's windows, as a
+        # DataFrame. exclude is a record (title and artist) to leave out,
+        # e.g. the queried song itself once it has been added.
+        rows, distances = self.search(song_vector(df), k + (exclude is not None), mode)
+        pairs = [(self.records[row], distance) for row, distance in zip(rows[0], distances[0]) if row >= 0]
+        if exclude is not None:
+            pairs = [pair for pair in pairs if self._key(pair[0]) != self._key(exclude)]
+        pairs = pairs[:k]
+
+        similar = pd.DataFrame([record for record, _ in pairs], columns=RECORD_FIELDS)
+        similar['distance'] = [distance for _, distance in pairs]
+        return similar
+
+    def save(self, index_dir):
+        with self._lock:
+            vectors, records = self.vectors, list(self.records)
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, 'vectors.npy'), vectors)
+        np.savez(os.path.join(index_dir, 'stats.npz'), center=self.center, scale=self.scale)
+        with open(os.path.join(index_dir, 'records.json'), 'w') as file:
+            json.dump(records, file)
+        if self.centroids is not None:
+            np.savez(os.path.join(index_dir, 'ivf.npz'),
+                     centroids=self.centroids, assignments=self.assignments)
+
+    @classmethod
+    def load(cls, index_dir):
+        stats = np.load(os.path.join(index_dir, 'stats.npz'))
+        with open(os.path.join(index_dir, 'records.json')) as file:
+            records = json.load(file)
+
+        index = cls.__new__(cls)
+        index.center = stats['center']
+        index.scale = stats['scale']
+        index.vectors = np.load(os.path.join(index_dir, 'vectors.npy'))
+        index.records = records
+        index._keys = {cls._key(record) for record in records}
+        index._norms = np.einsum('ij,ij->i', index.vectors, index.vectors)
+        index._lock = threading.Lock()
+        index.index_dir = index_dir
+        index.centroids = None
+        index.assignments = None
+        index._lists = None
+
+        ivf_path = os.path.join(index_dir, 'ivf.npz')
+        if os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            index.centroids = ivf['centroids']
+            index.assignments = ivf['assignments']
+
+        # Songs added from the app since the index was built. A line cut
+        # short by a crash is skipped.
+        added_path = os.path.join(index_dir, 'added.jsonl')
+        if os.path.exists(added_path):
+            vectors = []
+            added = []
+            with open(added_path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    vectors.append(entry['vector'])
+                    added.append(entry['record'])
+            if added:
+                index.add(np.array(vectors, dtype=np.float32), added)
+
+        return index
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Build the song similarity index')
+    parser.add_argument('--from-csv', metavar='DATA_DIR', default='./data/')
+    parser.add_argument('--out', default='./models/similarity/')
+    parser.add_argument('--ivf-lists', type=int, default=0,
+                        help='also train an IVF index with this many lists (0 for none)')
+    args = parser.parse_args()
+
+    csv_files = [file for file in os.listdir(args.from_csv) if file.endswith('.csv')]
+    full_df = pd.concat([pd.read_csv(os.path.join(args.from_csv, file),
+                                     usecols=['title', 'artist', 'genre'] + important_features)
+                         for file in csv_files], ignore_index=True)
+
+    vectors, records = catalog_vectors(full_df)
+    index = SimilarityIndex(vectors, records)
+    if args.ivf_lists:
+        index.train_ivf(args.ivf_lists)
+    index.save(args.out)
+    print(f"Indexed {len(index)} songs in {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Spectral features for the listening model from a single STFT. librosa's
+# mfcc, chroma_stft and beat_track each compute their own spectrogram of the
+# same signal; here the power spectrogram is computed once and the mel
+# spectrogram, MFCCs, chroma and onset envelope / tempo are all derived from
+# it, giving the same values as the separate librosa calls.
+from functools import lru_cache
+
+import numpy as np
+
+HOP_LENGTH = 512
+N_FFT = 2048
+
+
+@lru_cache(maxsize=16)
+def mel_filterbank(sr, n_fft):
+    import librosa
+    return librosa.filters.mel(sr=sr, n_fft=n_fft)
+
+
+@lru_cache(maxsize=64)
+def chroma_filterbank(sr, n_fft, tuning):
+    # Keyed on the estimated tuning too, which is quantised to 0.01 of a bin
+    import librosa
+    return librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=tuning, n_chroma=12)
+
+
+def power_spectrogram(y, n_fft=N_FFT, hop_length=HOP_LENGTH, center=True):
+    import librosa
+    return np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length, center=center)) ** 2
+
+
+def mel_db(power, sr, n_fft=N_FFT):
+    import librosa
+    mel = np.einsum("...ft,mf->...mt", power, mel_filterbank(sr, n_fft), optimize=True)
+    return librosa.power_to_db(mel)
+
+
+def mfcc_from_mel_db(mel_db_spectrogram, n_mfcc=12):
+    import librosa
+    return librosa.feature.mfcc(S=mel_db_spectrogram, n_mfcc=n_mfcc)
+
+
+def chroma_from_power(power, sr, n_fft=N_FFT):
+    import librosa
+    tuning = float(librosa.estimate_tuning(S=power, sr=sr, bins_per_octave=12))
+    raw_chroma = np.einsum("cf,...ft->...ct", chroma_filterbank(sr, n_fft, tuning), power,
+                           optimize=True)
+    return librosa.util.normalize(raw_chroma, norm=np.inf, axis=-2)
+
+
+def onset_envelope(mel_db_spectrogram, sr, hop_length=HOP_LENGTH, n_fft=N_FFT):
+    import librosa
+    return librosa.onset.onset_strength(S=mel_db_spectrogram, sr=sr, hop_length=hop_length,
+                                        n_fft=n_fft, aggregate=np.median)
+
+
+def estimate_tempo(envelope, sr, hop_length=HOP_LENGTH):
+    import librosa
+    # beat_track's tempo without running the beat tracker itself
+    if not envelope.any():
+        return 0
+    tempo = librosa.feature.tempo(onset_envelope=envelope, sr=sr, hop_length=hop_length)
+    return round(float(np.squeeze(tempo)))
+
+
+def spectral_features(y, sr, n_fft=N_FFT, hop_length=HOP_LENGTH):
+
+    # Returns (mfccs, chromagram, tempo) as librosa.feature.mfcc(n_mfcc=12),
+    # librosa.feature.chroma_stft and librosa.beat.beat_track would
+    power = power_spectrogram(y, n_fft=n_fft, hop_length=hop_length)
+    mel = mel_db(power, sr, n_fft)
+
+    mfccs = mfcc_from_mel_db(mel)
+    chromagram = chroma_from_power(power, sr, n_fft)
+    tempo = estimate_tempo(onset_envelope(mel, sr, hop_length, n_fft), sr, hop_length)
+
+    return mfccs, chromagram, tempo
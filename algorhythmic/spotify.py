@@ -0,0 +1,133 @@
+# Talking to the Spotify API. The client (sp) is created by the caller, so
+# nothing here needs spotipy until an error has to be recognised.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .features import track_features
+from .instrument import count, span
+
+
+def find_track(sp, song_title, artist_name):
+
+    results = sp.search(q=f"{song_title}, {artist_name}", type='track')
+    track = results['tracks']['items'][0]
+
+    return track
+
+
+def stored_track_features(sp, track, cache=None, store=None):
+
+    # Condensed windows come from the feature store when it has the track,
+    # otherwise they are computed and saved there for next time. With a
+    # store, both paths return the stored columns (see FeatureStore.put).
+    if store is not None:
+        df = store.get(track['id'])
+        if df is not None:
+            return df
+
+    df = track_features(sp, track, cache)
+    if store is not None:
+        df = store.put(track['id'], df)
+
+    return df
+
+
+def fetch_track_features(sp, track, cache=None, store=None):
+
+    from spotipy.exceptions import SpotifyException
+
+    # A track is either a Spotify track ID or a (title, artist) pair
+    try:
+        if isinstance(track, str):
+            # A stored track ID doesn't need any Spotify call at all
+            if store is not None:
+                df = store.get(track)
+                if df is not None:
+                    return df
+            track = sp.track(track)
+        else:
+            track = find_track(sp, *track)
+        return stored_track_features(sp, track, cache, store)
+
+    # Tracks without audio analysis (or that can't be found) are skipped
+    except (ValueError, KeyError, IndexError, SpotifyException):
+        return None
+
+
+class GenrePools:
+
+    # Search results per genre, kept for ttl seconds and shared by every
+    # caller in the process
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, genre):
+        with self._lock:
+            cached = self._pools.get(genre)
+        if cached is None or time.monotonic() - cached[0] > self.ttl:
+            return None
+        return cached[1]
+
+    def put(self, genre, items):
+        with self._lock:
+            self._pools[genre] = (time.monotonic(), items)
+
+    def clear(self):
+        with self._lock:
+            self._pools.clear()
+
+
+genre_pools = GenrePools()
+
+
+def genre_query(genre):
+    # Plain 'pop' is too broad a search, its recommendations come from dance pop
+    if genre == 'pop':
+        genre = 'dance pop'
+    return f"genre:{genre}, tag:hipster"
+
+
+def genre_pool(sp, genre, pools=genre_pools):
+
+    if pools is not None:
+        items = pools.get(genre)
+        if items is not None:
+            count('genre_pool.hit')
+            return items
+        count('genre_pool.miss')
+
+    with span('recs.search', genre=genre):
+        results = sp.search(q=genre_query(genre), type='track', limit=50, market='US')
+    items = results['tracks']['items']
+
+    if pools is not None:
+        pools.put(genre, items)
+
+    return items
+
+
+def pick_recommendations(sp, genre_list, max_workers=5, pools=genre_pools):
+
+    # The genre searches run concurrently (at most max_workers at a time) and
+    # are served from pools when a genre was searched within its ttl
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(genre_list)))) as pool:
+        genre_items = list(pool.map(lambda genre: genre_pool(sp, genre, pools), genre_list))
+
+    recs = []
+
+    for items in genre_items:
+
+        choice = np.random.choice(len(items))
+
+        item = items[choice]
+        recs.append({'track': item['name'],
+                     'artist': item['artists'][0]['name'],
+                     'url': item['preview_url'],
+                     'image': item['album']['images'][1]['url']})
+
+    return recs
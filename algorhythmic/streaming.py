@@ -0,0 +1,135 @@
+# Streaming version of the listening pipeline. Audio is decoded in blocks with
+# soundfile, resampled to the model's rate with a streaming resampler, and
+# MFCC/chroma frames are computed one 3 second window at a time, carrying the
+# n_fft overlap across block boundaries so every frame sees the same samples
+# it would in a whole-signal STFT. Memory stays bounded by the window length
+# and the first prediction is ready after the first 3 seconds of audio.
+#
+# Things that need the whole clip are approximated causally:
+# * min-max scaling uses the running min/max of the frames seen so far
+# * the tempo is estimated from the onset envelope of the last tempo_seconds
+#   (a ring of per-window envelopes), so each window costs the same however
+#   long the recording is
+# * leading/trailing silence is not trimmed
+# * power_to_db's top_db clipping and chroma tuning are per window
+# so streamed rows are close to, not identical to, output_features.
+import io
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from .features import mfcc_columns, chroma_columns
+from .spectral import (HOP_LENGTH,
+                       N_FFT,
+                       power_spectrogram,
+                       mel_db,
+                       mfcc_from_mel_db,
+                       chroma_from_power,
+                       onset_envelope,
+                       estimate_tempo)
+
+SAMPLE_RATE = 22050
+
+
+def decode_blocks(audio, sr=SAMPLE_RATE, block_seconds=3.0):
+
+    # Yields mono float32 blocks at sr from audio bytes, a path or a file object
+    import soundfile as sf
+    import soxr
+
+    if isinstance(audio, (bytes, bytearray)):
+        audio = io.BytesIO(audio)
+
+    with sf.SoundFile(audio) as file:
+        resampler = None
+        if file.samplerate != sr:
+            resampler = soxr.ResampleStream(file.samplerate, sr, 1, dtype='float32')
+
+        blocksize = int(block_seconds * file.samplerate)
+        for block in file.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+            # Same mix down as librosa.to_mono
+            mono = block.mean(axis=1)
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono)
+            if len(mono):
+                yield mono
+
+        if resampler is not None:
+            tail = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+            if len(tail):
+                yield tail
+
+
+def window_frames(blocks, frames_per_window, hop_length=HOP_LENGTH, n_fft=N_FFT):
+
+    # Regroups sample blocks into (window_samples, n_frames) so that frame t
+    # is centred on sample t * hop_length, like librosa's center=True with
+    # zero padding. Each window carries n_fft - hop_length samples of overlap
+    # from the previous one.
+    pad = n_fft // 2
+    window_length = (frames_per_window - 1) * hop_length + n_fft
+    step = frames_per_window * hop_length
+
+    buffer = np.zeros(pad, dtype=np.float32)
+    yielded = False
+
+    for block in blocks:
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= window_length:
+            yield buffer[:window_length], frames_per_window
+            yielded = True
+            buffer = buffer[step:]
+
+    # The trailing partial window is dropped, like the leftover rows in
+    # condense_output_data, unless it's all there is
+    if not yielded:
+        buffer = np.concatenate([buffer, np.zeros(pad, dtype=np.float32)])
+        n_frames = 1 + (len(buffer) - n_fft) // hop_length
+        if n_frames >= 2:
+            yield buffer[:(n_frames - 1) * hop_length + n_fft], n_frames
+
+
+def stream_output_features(audio, sr=SAMPLE_RATE, hop_length=HOP_LENGTH, n_fft=N_FFT,
+                           window_seconds=3.0, tempo_seconds=30.0):
+
+    # Yields one condensed feature row (a 1 row DataFrame with the same
+    # columns as output_features) per 3 second window
+    frames_per_window = round(window_seconds * sr / hop_length)
+    running_min = None
+    running_max = None
+    envelopes = deque(maxlen=max(1, math.ceil(tempo_seconds / window_seconds)))
+
+    blocks = decode_blocks(audio, sr=sr, block_seconds=window_seconds)
+    for samples, n_frames in window_frames(blocks, frames_per_window, hop_length, n_fft):
+
+        power = power_spectrogram(samples, n_fft=n_fft, hop_length=hop_length, center=False)
+        mel = mel_db(power, sr, n_fft)
+        mfccs = mfcc_from_mel_db(mel)
+        chromagram = chroma_from_power(power, sr, n_fft)
+
+        frames = np.vstack([mfccs, chromagram]).T
+
+        # Min-max scale on the range of everything seen so far
+        if running_min is None:
+            running_min = frames.min(axis=0)
+            running_max = frames.max(axis=0)
+        else:
+            running_min = np.minimum(running_min, frames.min(axis=0))
+            running_max = np.maximum(running_max, frames.max(axis=0))
+        value_range = running_max - running_min
+        value_range[value_range == 0] = 1
+        scaled = (frames - running_min) / value_range
+
+        mean = scaled.mean(axis=0)
+        std = scaled.std(axis=0, ddof=1)
+
+        envelopes.append(onset_envelope(mel, sr, hop_length, n_fft))
+        tempo = estimate_tempo(np.concatenate(envelopes), sr, hop_length)
+
+        row = pd.DataFrame([np.concatenate([mean[:12], std[:12], mean[12:], std[12:]])],
+                           columns=mfcc_columns + chroma_columns)
+        row['tempo'] = tempo
+
+        yield row
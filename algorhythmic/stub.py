@@ -0,0 +1,124 @@
+# Local stand-ins for trying the pipeline offline. StubSpotify replaces
+# spotipy.Spotify: audio analyses come from <fixture_dir>/<track_id>.json
+# when present and are otherwise generated deterministically from the track
+# ID. StandInModel replaces either model when it can't be loaded.
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def synthetic_analysis(track_id, duration=200.0, segments_per_second=4):
+
+    rng = np.random.default_rng(int(hashlib.sha1(track_id.encode()).hexdigest()[:8], 16))
+    n_segments = max(1, int(duration * segments_per_second))
+
+    timbre = rng.normal(0, 40, (n_segments, 12))
+    pitches = rng.random((n_segments, 12))
+    loudness_max = rng.normal(-8, 4, n_segments)
+    loudness_start = loudness_max - rng.random(n_segments) * 20
+    loudness_max_time = rng.random(n_segments) * 0.2
+
+    segments = [{'loudness_start': float(loudness_start[row]),
+                 'loudness_max_time': float(loudness_max_time[row]),
+                 'loudness_max': float(loudness_max[row]),
+                 'pitches': pitches[row].tolist(),
+                 'timbre': timbre[row].tolist()}
+                for row in range(n_segments)]
+
+    return {'track': {'duration': duration,
+                      'end_of_fade_in': float(rng.random() * 2),
+                      'start_of_fade_out': duration - float(rng.random() * 8),
+                      'tempo': float(rng.uniform(60, 180))},
+            'segments': segments}
+
+
+def synthetic_track(track_id, name=None, artist=None):
+    return {'id': track_id,
+            'name': name or f'Track {track_id}',
+            'artists': [{'name': artist or f'Artist {track_id}'}],
+            'preview_url': f'https://example.invalid/preview/{track_id}.mp3',
+            'album': {'name': f'Album {track_id}',
+                      'release_date': '2000-01-01',
+                      'artists': [{'name': artist or f'Artist {track_id}'}],
+                      'images': [{'url': f'https://example.invalid/{track_id}/640.jpg'},
+                                 {'url': f'https://example.invalid/{track_id}/300.jpg'}]}}
+
+
+class StubSpotify:
+
+    def __init__(self, fixture_dir=None, duration=200.0):
+        self.fixture_dir = fixture_dir
+        self.duration = duration
+        # Number of calls made to each endpoint, so callers can check caching
+        self.calls = {'search': 0, 'track': 0, 'audio_analysis': 0}
+
+    def search(self, q, type='track', limit=10, market=None):
+        self.calls['search'] += 1
+        key = hashlib.sha1(q.encode()).hexdigest()[:12]
+        items = [synthetic_track(f'{key}{n:02d}') for n in range(limit)]
+        return {'tracks': {'items': items}}
+
+    def track(self, track_id):
+        self.calls['track'] += 1
+        return synthetic_track(track_id)
+
+    def audio_analysis(self, track_id):
+        self.calls['audio_analysis'] += 1
+        if self.fixture_dir is not None:
+            path = os.path.join(self.fixture_dir, f'{track_id}.json')
+            if os.path.exists(path):
+                with open(path) as file:
+                    return json.load(file)
+        return synthetic_analysis(track_id, self.duration)
+
+
+class StandInModel:
+
+    # Random softmax over a dense layer, shaped like the real models
+    def __init__(self, n_features, n_genres=50, seed=0):
+        self.weights = np.random.default_rng(seed).normal(size=(n_features, n_genres))
+
+    def predict_proba(self, x):
+        logits = np.asarray(x, dtype=np.float64) @ self.weights
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def predict(self, x, **kwargs):
+        return self.predict_proba(x)
+
+
+def keras_stand_in(n_features=17, seed=0):
+
+    # Untrained Keras model with the scraping model's architecture (see
+    # models/keras_2/keras_metadata.pb: LeakyReLU alpha 0.1, dropout 0.3),
+    # for timing Keras code paths without the real weights
+    import keras
+
+    keras.utils.set_random_seed(seed)
+    layers = [keras.Input((n_features,))]
+    for n, units in enumerate([1700, 969, 600, 400, 200, 100]):
+        layers.append(keras.layers.Dense(units, activation=keras.layers.LeakyReLU(negative_slope=0.1)))
+        if n in (2, 5):
+            layers.append(keras.layers.Dropout(0.3))
+    layers.append(keras.layers.Dense(50, activation='softmax'))
+    return keras.Sequential(layers)
+
+
+def xgb_stand_in(n_features=49, n_genres=50, n_estimators=30, seed=0):
+
+    # XGBClassifier trained on random windows, shaped like the listening
+    # model, for timing XGBoost code paths without the real model
+    import pandas as pd
+    import xgboost as xgb
+
+    from .features import mfcc_columns, chroma_columns
+
+    rng = np.random.default_rng(seed)
+    columns = (mfcc_columns + chroma_columns + ['tempo'])[:n_features]
+    x = pd.DataFrame(rng.random((100 * n_genres, n_features), dtype=np.float32), columns=columns)
+    y = np.arange(len(x)) % n_genres
+    return xgb.XGBClassifier(n_estimators=n_estimators, max_depth=6, tree_method='hist',
+                             random_state=seed).fit(x, y)
@@ -0,0 +1,115 @@
+# Throughput of the offline classifier (algorhythmic.classify) with 1, 2, 4 ...
+# worker processes on a directory of synthetic recordings, plus a check that
+# its labels match predict_output's for the same files and a resumed run.
+#
+#   python benchmarks/batch_classify.py [--files 64] [--seconds 30]
+#                                       [--workers 1,2,4] [--json results.json]
+#
+# The real listening model is used when it can be loaded, otherwise a
+# stand-in trained on random windows (algorhythmic.stub.xgb_stand_in), saved
+# to a file so every worker can load it.
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from algorhythmic.classify import classify_directory
+from algorhythmic.inference import XGBoostEngine
+from algorhythmic.models import LISTENING_MODEL_PATH, load_listening_model
+from algorhythmic.predict import predict_output
+
+
+def write_recordings(audio_dir, n_files, seconds, sr=22050):
+
+    # A few tones plus noise, at a random tempo of clicks, half WAV half FLAC
+    import soundfile as sf
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sr)) / sr
+    for n in range(n_files):
+        y = sum(np.sin(2 * np.pi * freq * t) for freq in rng.uniform(80, 2000, 3)) / 3
+        y[(t * rng.uniform(1, 3)) % 1 < 0.01] += 0.5
+        y += rng.normal(0, 0.05, len(t))
+        sf.write(os.path.join(audio_dir, f'clip{n:04d}.{"wav" if n % 2 else "flac"}'),
+                 (0.5 * y).astype(np.float32), sr)
+
+
+def model_file(tmp):
+    try:
+        load_listening_model()
+        return LISTENING_MODEL_PATH, 'real'
+    except Exception as error:
+        print(f"listening model unavailable ({type(error).__name__}), using a stand-in")
+        from algorhythmic.stub import xgb_stand_in
+        path = os.path.join(tmp, 'stand_in.json')
+        xgb_stand_in().save_model(path)
+        return path, 'stand-in'
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--workers', default=','.join(str(2 ** n) for n in range(8)
+                                                     if 2 ** n <= (os.cpu_count() or 1)))
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        audio_dir = os.path.join(tmp, 'audio')
+        os.makedirs(audio_dir)
+        write_recordings(audio_dir, args.files, args.seconds)
+        model_path, kind = model_file(tmp)
+        print(f"{args.files} files of {args.seconds:.0f}s, {os.cpu_count()} cores, {kind} model")
+
+        results = []
+        for workers in [int(n) for n in args.workers.split(',')]:
+            out = os.path.join(tmp, f'labels-{workers}.csv')
+            summary = classify_directory(audio_dir, out, model_path, workers, report_every=60, log=lambda *_: None)
+            results.append(summary)
+            print(f"{workers:3d} workers: {summary['files_per_second']:6.2f} files/s "
+                  f"({summary['files_per_second'] / results[0]['files_per_second']:.2f}x)")
+
+        # Same labels as predict_output on a few files
+        labels = pd.read_csv(out).set_index('path')
+        engine = XGBoostEngine(load_listening_model(model_path))
+        same = 0
+        names = sorted(labels.index)[:4]
+        for name in names:
+            with open(os.path.join(audio_dir, name), 'rb') as file:
+                _, votes = predict_output(engine, file.read())
+            same += votes.index[0] == labels.loc[name, 'genre_1']
+        print(f"top genre matches predict_output on {same}/{len(names)} files")
+
+        # A resumed Parquet run: the first half, then the rest
+        out = os.path.join(tmp, 'labels.parquet')
+        names = sorted(os.listdir(audio_dir))
+        half_dir = os.path.join(tmp, 'half')
+        os.makedirs(half_dir)
+        for name in names[:len(names) // 2]:
+            os.link(os.path.join(audio_dir, name), os.path.join(half_dir, name))
+        classify_directory(half_dir, out, model_path, 1, log=lambda *_: None)
+        resumed = classify_directory(audio_dir, out, model_path, 1, log=lambda *_: None)
+        combined = pd.read_parquet(out)
+        print(f"resumed run: skipped {resumed['skipped']}, classified {resumed['files']}, "
+              f"{combined['path'].nunique()}/{len(names)} files in the output")
+
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump({'model': kind, 'files': args.files, 'seconds': args.seconds,
+                           'results': results}, file, indent=2)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Throughput of the scraping model under concurrent predict_spotify calls:
+# model.predict per call (the plain path), a direct tf.function call per call
+# (keras_predictor) and the micro-batched model (batched_keras_model), at 1 to
+# 64 concurrent callers, each classifying tracks of --windows windows.
+#
+#   python benchmarks/batching.py [--concurrency 1,2,4,8,16,32,64] [--requests 20]
+#                                 [--max-wait-ms 2] [--json results.json]
+#
+# The real model is used when it can be loaded, otherwise an untrained model
+# with the same architecture (algorhythmic.stub.keras_stand_in).
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from algorhythmic.batching import batched_keras_model, keras_predictor
+from algorhythmic.features import important_features
+
+
+def load_model():
+    try:
+        from algorhythmic.models import load_scraping_model
+        return load_scraping_model(), 'real'
+    except Exception as error:
+        print(f"scraping model unavailable ({type(error).__name__}), using a stand-in")
+        from algorhythmic.stub import keras_stand_in
+        return keras_stand_in(len(important_features)), 'stand-in'
+
+
+def run(predict, concurrency, requests, windows):
+
+    x = np.random.default_rng(0).random((windows, len(important_features)), dtype=np.float32)
+    latencies = [[] for _ in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1, timeout=120)
+
+    def worker(n):
+        barrier.wait()
+        for _ in range(requests):
+            start = time.perf_counter()
+            predict(x)
+            latencies[n].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    milliseconds = np.concatenate(latencies) * 1000
+    return {'requests_per_s': concurrency * requests / seconds,
+            'p50_ms': float(np.percentile(milliseconds, 50)),
+            'p99_ms': float(np.percentile(milliseconds, 99))}
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32,64')
+    parser.add_argument('--requests', type=int, default=20, help='requests per caller')
+    parser.add_argument('--windows', type=int, default=60, help='windows per request')
+    parser.add_argument('--max-batch', type=int, default=4096)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    model, kind = load_model()
+    direct = keras_predictor(model, len(important_features))
+    batched = batched_keras_model(model, args.max_batch, args.max_wait_ms / 1000)
+    modes = {'predict': lambda x: model.predict(x, verbose=0),
+             'direct': direct,
+             'batched': batched.predict}
+
+    # Trace and warm up every path
+    x = np.zeros((args.windows, len(important_features)), dtype=np.float32)
+    for predict in modes.values():
+        predict(x)
+
+    results = []
+    print(f"{'callers':>7} {'mode':8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'req/batch':>9}")
+    for concurrency in [int(n) for n in args.concurrency.split(',')]:
+        for mode, predict in modes.items():
+            before = batched.batcher.stats()
+            result = run(predict, concurrency, args.requests, args.windows)
+            after = batched.batcher.stats()
+            batches = after['batches'] - before['batches']
+            result.update({'concurrency': concurrency, 'mode': mode,
+                           'requests_per_batch': (after['requests'] - before['requests']) / batches
+                           if batches else None})
+            results.append(result)
+            print(f"{concurrency:7d} {mode:8} {result['requests_per_s']:8.1f} {result['p50_ms']:8.2f} "
+                  f"{result['p99_ms']:8.2f} {result['requests_per_batch'] or 0:9.1f}")
+
+    batched.close()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'model': kind, 'windows': args.windows, 'cpus': os.cpu_count(),
+                       'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
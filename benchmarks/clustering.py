@@ -0,0 +1,114 @@
+# Scaling of the out-of-core clustering pipeline (algorhythmic.clustering) on
+# synthetic data: a mixture of Gaussian "genres" over important_features
+# written as shards, fitted with 1, 2, 4, ... workers.
+#
+#   python benchmarks/clustering.py [--rows 1000000] [--k 200] [--rounds 50]
+#                                   [--workers 1,2,4,8] [--json results.json]
+#
+# Reports rounds/s and rows/s for fitting (rows sampled per second), the time
+# spent outside the rounds (standardisation stats, seeding and the final
+# assignment pass over every row), plus how well the
+# found clusters recover the generating ones (adjusted Rand index on a sample,
+# when sklearn is installed).
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from algorhythmic.clustering import ShardedKMeans, write_shards, shard_paths
+from algorhythmic.features import important_features
+
+
+def synthetic_frames(rows, k, chunk=100_000, seed=0):
+
+    # Chunks of windows drawn from k Gaussian blobs, with the true blob as
+    # the song key so recovery can be checked
+    rng = np.random.default_rng(seed)
+    means = rng.normal(scale=3, size=(k, len(important_features)))
+    for start in range(0, rows, chunk):
+        n = min(chunk, rows - start)
+        blobs = rng.integers(k, size=n)
+        x = means[blobs] + rng.normal(size=(n, len(important_features)))
+        frame = pd.DataFrame(x.astype(np.float32), columns=important_features)
+        frame['title'] = blobs
+        frame['artist'] = ''
+        yield frame
+
+
+def recovery(shard_dir, out_dir, n=20_000):
+    try:
+        from sklearn.metrics import adjusted_rand_score
+    except ImportError:
+        return None
+    path = shard_paths(shard_dir)[0]
+    truth = np.array([int(key.split('\t')[0]) for key in np.load(path[:-4] + '.keys.npy')[:n]])
+    found = np.load(os.path.join(out_dir, 'assignments', os.path.basename(path)))[:n]
+    return float(adjusted_rand_score(truth, found))
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--k', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=4096)
+    parser.add_argument('--rows-per-shard', type=int, default=250_000)
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        shard_dir = os.path.join(tmp, 'shards')
+        start = time.perf_counter()
+        n_shards = write_shards(synthetic_frames(args.rows, args.k), shard_dir, args.rows_per_shard)
+        print(f"Wrote {args.rows} rows in {n_shards} shards in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'workers':>7} {'fit s':>8} {'rounds/s':>9} {'fit rows/s':>11} "
+              f"{'other s':>8} {'inertia':>8} {'ARI':>6}")
+        for workers in [int(n) for n in args.workers.split(',')]:
+            out_dir = os.path.join(tmp, f'clusters-{workers}')
+            model = ShardedKMeans(args.k, args.batch_size, args.rounds, tol=0, workers=workers,
+                                  checkpoint_every=args.rounds)
+
+            start = time.perf_counter()
+            clusters = model.fit(shard_dir, out_dir, resume=False, log=lambda message: None)
+            total = time.perf_counter() - start
+
+            with open(os.path.join(out_dir, 'checkpoint.json')) as file:
+                history = json.load(file)['history']
+            fit_seconds = sum(row['seconds'] for row in history)
+            # Standardisation stats, seeding and the assignment pass
+            other_seconds = total - fit_seconds
+
+            result = {'workers': workers,
+                      'rows': args.rows,
+                      'k': args.k,
+                      'rounds': len(history),
+                      'fit_seconds': fit_seconds,
+                      'rounds_per_s': len(history) / fit_seconds,
+                      'fit_rows_per_s': len(history) * workers * args.batch_size / fit_seconds,
+                      'total_seconds': total,
+                      'other_seconds': other_seconds,
+                      'inertia': clusters.meta['inertia'],
+                      'ari': recovery(shard_dir, out_dir)}
+            results.append(result)
+            print(f"{workers:7d} {fit_seconds:8.2f} {result['rounds_per_s']:9.1f} "
+                  f"{result['fit_rows_per_s']:11.0f} {other_seconds:8.2f} {result['inertia']:8.3f} "
+                  f"{result['ari'] if result['ari'] is not None else float('nan'):6.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'cpus': os.cpu_count(), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
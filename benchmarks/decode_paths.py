@@ -0,0 +1,86 @@
+# Latency against feature drift for the decode modes of output_features, on
+# the sample WAVs that ship with the repo.
+#
+#   python benchmarks/decode_paths.py [--runs 7] [--json results.json]
+#
+# Drift is measured against the 'librosa' mode, which is what the listening
+# model was trained on: the mean and max absolute difference over the MFCC
+# and chroma columns, and whether the tempo changed.
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from algorhythmic.features import decode_audio, output_features
+
+MODES = ['librosa', 'polyphase', 'native']
+
+DEFAULT_FILES = ['output.wav'] + sorted(glob.glob('songs_images/*.wav'))
+
+
+def median_seconds(function, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def compare(path, runs):
+
+    with open(path, 'rb') as file:
+        audio_bytes = file.read()
+
+    reference = output_features(audio_bytes, 'librosa')
+    results = []
+
+    for mode in MODES:
+        # Warm up once so numba compilation etc. isn't timed
+        features = output_features(audio_bytes, mode)
+
+        decode_time = median_seconds(lambda: decode_audio(audio_bytes, mode), runs)
+        total_time = median_seconds(lambda: output_features(audio_bytes, mode), runs)
+
+        rows = min(len(features), len(reference))
+        drift = np.abs(features.iloc[:rows, :48].to_numpy() - reference.iloc[:rows, :48].to_numpy())
+
+        results.append({'file': path,
+                        'mode': mode,
+                        'decode_ms': decode_time * 1000,
+                        'features_ms': total_time * 1000,
+                        'windows': len(features),
+                        'mean_drift': float(drift.mean()) if drift.size else 0.0,
+                        'max_drift': float(drift.max()) if drift.size else 0.0,
+                        'tempo_changed': bool(features['tempo'].iloc[0] != reference['tempo'].iloc[0])})
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', default=DEFAULT_FILES)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    all_results = []
+    print(f"{'file':32} {'mode':10} {'decode ms':>10} {'total ms':>10} {'mean drift':>11} "
+          f"{'max drift':>10} {'tempo':>6}")
+    for path in args.files:
+        for result in compare(path, args.runs):
+            all_results.append(result)
+            print(f"{result['file']:32} {result['mode']:10} {result['decode_ms']:10.1f} "
+                  f"{result['features_ms']:10.1f} {result['mean_drift']:11.4f} "
+                  f"{result['max_drift']:10.4f} {'moved' if result['tempo_changed'] else 'same':>6}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(all_results, file, indent=2)
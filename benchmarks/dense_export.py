@@ -0,0 +1,150 @@
+# Keras SavedModel against the NumPy exports of the scraping model
+# (algorhythmic.dense) in float32, float16 and int8: load time and peak RSS
+# of a fresh process that imports and loads the model, per-window latency,
+# and how often the genre votes agree with the Keras model.
+#
+#   python benchmarks/dense_export.py [--tracks 200] [--data ./data/] [--json results.json]
+#
+# The validation tracks are songs from --data when it exists, otherwise
+# synthetic audio analyses run through the real feature pipeline. The real
+# model is used when it can be loaded, otherwise an untrained model with the
+# same architecture (algorhythmic.stub.keras_stand_in). Agreement for the
+# stand-in is pessimistic, because its near-uniform outputs flip easily.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from algorhythmic.dense import export_keras
+from algorhythmic.features import important_features, condense_segments, build_segment_matrix
+from algorhythmic.models import SCRAPING_MODEL_PATH, load_scraping_model
+from algorhythmic.predict import weighted_votes
+from algorhythmic.stub import synthetic_analysis
+
+LOAD_SCRIPT = """
+import json, sys, time
+import numpy as np
+start = time.perf_counter()
+from algorhythmic.models import load_scraping_model
+model = load_scraping_model(sys.argv[1], sys.argv[2])
+loaded = time.perf_counter() - start
+model.predict(np.zeros((1, 17), dtype=np.float32), verbose=0)
+first_predict = time.perf_counter() - start - loaded
+# VmHWM rather than ru_maxrss, which Linux carries over from the parent
+# process across fork + exec
+peak = [line for line in open('/proc/self/status') if line.startswith('VmHWM')][0]
+print(json.dumps({'load_seconds': loaded,
+                  'first_predict_seconds': first_predict,
+                  'max_rss_mb': int(peak.split()[1]) / 1024}))
+"""
+
+
+def validation_tracks(data_dir, n_tracks):
+
+    # A list of (n_windows, 17) float32 arrays, one per track
+    if data_dir and os.path.isdir(data_dir):
+        from algorhythmic.dataset import load_dataset
+        df, _ = load_dataset(data_dir, ['title'] + important_features)
+        titles = df['title'].drop_duplicates().sample(min(n_tracks, df['title'].nunique()), random_state=0)
+        df = df[df['title'].isin(titles)]
+        return [group[important_features].to_numpy(np.float32) for _, group in df.groupby('title', observed=True)]
+
+    tracks = []
+    for n in range(n_tracks):
+        analysis = synthetic_analysis(f'validation{n}', duration=120 + n % 180)
+        info = analysis['track']
+        windows = condense_segments(build_segment_matrix(analysis['segments']), info['duration'],
+                                    info['end_of_fade_in'], info['duration'] - info['start_of_fade_out'])
+        windows['tempo'] = round(info['tempo'])
+        tracks.append(windows[important_features].to_numpy(np.float32))
+    return tracks
+
+
+def load_stats(path, engine):
+    output = subprocess.run([sys.executable, '-c', LOAD_SCRIPT, path, engine], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def per_window_ms(model, windows, runs=20):
+    model.predict(windows, verbose=0)
+    start = time.perf_counter()
+    for _ in range(runs):
+        model.predict(windows, verbose=0)
+    return (time.perf_counter() - start) / runs / len(windows) * 1000
+
+
+def agreement(reference, candidate):
+    # Share of tracks with the same top genre, and of windows with the same
+    # most likely genre
+    same_top = [weighted_votes(a).index[0] == weighted_votes(b).index[0]
+                for a, b in zip(reference, candidate)]
+    windows = np.concatenate([a.argmax(axis=1) == b.argmax(axis=1) for a, b in zip(reference, candidate)])
+    return float(np.mean(same_top)), float(windows.mean())
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=200)
+    parser.add_argument('--data', default='./data/')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        keras_model = load_scraping_model(SCRAPING_MODEL_PATH, 'keras')
+        keras_path, kind = SCRAPING_MODEL_PATH, 'real'
+    except Exception as error:
+        print(f"scraping model unavailable ({type(error).__name__}), using a stand-in")
+        from algorhythmic.stub import keras_stand_in
+        keras_model = keras_stand_in(len(important_features))
+        keras_path, kind = os.path.join(tmp, 'stand_in.keras'), 'stand-in'
+        keras_model.save(keras_path)
+
+    tracks = validation_tracks(args.data, args.tracks)
+    reference = [keras_model.predict(windows, verbose=0) for windows in tracks]
+    track = tracks[0]
+
+    engines = [('keras', keras_path, keras_model)]
+    for dtype in ['float32', 'float16', 'int8']:
+        path = os.path.join(tmp, f'scraping_dense_{dtype}.npz')
+        engines.append((f'numpy-{dtype}', path, export_keras(keras_model, path, dtype)))
+
+    results = []
+    print(f"{'engine':14} {'file MB':>8} {'load s':>7} {'RSS MB':>7} {'1 win ms':>9} "
+          f"{'ms/win@' + str(len(track)):>10} {'same top':>9} {'same win':>9}")
+    for name, path, model in engines:
+        stats = load_stats(path, 'keras' if name == 'keras' else 'numpy')
+        same_top, same_window = agreement(reference, [model.predict(windows, verbose=0)
+                                                      for windows in tracks])
+        size = (sum(os.path.getsize(os.path.join(dirpath, file)) for dirpath, _, files in os.walk(path)
+                    for file in files) if os.path.isdir(path) else os.path.getsize(path))
+        result = {'engine': name,
+                  'file_mb': size / 1024 ** 2,
+                  **stats,
+                  'single_window_ms': per_window_ms(model, track[:1]),
+                  'per_window_ms_batch': per_window_ms(model, track),
+                  'batch_windows': len(track),
+                  'same_top_genre': same_top,
+                  'same_window_genre': same_window}
+        results.append(result)
+        print(f"{name:14} {result['file_mb']:8.1f} {result['load_seconds']:7.2f} {result['max_rss_mb']:7.0f} "
+              f"{result['single_window_ms']:9.3f} {result['per_window_ms_batch']:10.4f} "
+              f"{same_top:9.1%} {same_window:9.1%}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'model': kind, 'tracks': len(tracks), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Import-time budget for the core library. Each measurement runs in a fresh
+# interpreter so nothing is already cached in sys.modules.
+#
+#   python benchmarks/import_time.py
+#
+# Exits non-zero if importing algorhythmic takes longer than the budget or
+# drags in any of the heavy frameworks.
+import json
+import subprocess
+import sys
+
+# Median seconds allowed for `import algorhythmic` (numpy + pandas dominate)
+IMPORT_BUDGET = 1.0
+
+HEAVY_MODULES = ['tensorflow', 'keras', 'xgboost', 'librosa', 'sklearn', 'streamlit', 'spotipy']
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed,
+                  'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module, runs=5):
+
+    timings = []
+    heavy = set()
+
+    for _ in range(runs):
+        code = MEASURE.format(module=module, heavy=HEAVY_MODULES)
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                                text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result['seconds'])
+        heavy.update(result['heavy'])
+
+    return sorted(timings)[len(timings) // 2], sorted(heavy)
+
+
+if __name__ == '__main__':
+
+    median, heavy = measure('algorhythmic')
+    print(f"import algorhythmic: {median:.3f}s median (budget {IMPORT_BUDGET:.1f}s)")
+
+    if heavy:
+        print(f"heavy modules imported eagerly: {', '.join(heavy)}")
+    if heavy or median > IMPORT_BUDGET:
+        sys.exit(1)
@@ -0,0 +1,301 @@
+# Offline benchmark of the feature-extraction and prediction hot paths.
+#
+#   python benchmarks/run.py [--runs 5] [--quick] [--fixtures DIR]
+#                            [--json results.json] [--compare baseline.json]
+#
+# Listening path cases: output.wav, the WAVs in songs_images/ and synthetic
+# clips from 3 seconds to 10 minutes. Stages: decode, features (trim + STFT
+# features), condense, inference, votes.
+#
+# Spotify path cases: audio-analysis JSON fixtures from --fixtures (one
+# <track_id>.json per track, e.g. recorded with json.dump(sp.audio_analysis(id)))
+# or synthetic analyses of 30 seconds to 10 minutes. Stages: parse, segments,
+# condense, inference, votes.
+#
+# Every stage reports p50/p90/p99 latency, throughput and peak traced memory.
+# Results can be saved as JSON and compared against an earlier run; stages
+# that got slower than --threshold are flagged and make the run exit with 1.
+#
+# The real models are used when they can be loaded. When they can't (e.g. a
+# checkout without the git-lfs objects) a random dense stand-in with the same
+# input and output shapes is used, and the results say so.
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from algorhythmic.features import (important_features,
+                                   decode_audio,
+                                   signal_features,
+                                   condense_output_features,
+                                   build_segment_matrix,
+                                   condense_segments)
+from algorhythmic.predict import weighted_votes
+from algorhythmic.stub import synthetic_analysis, StandInModel
+
+SAMPLE_WAVS = ['output.wav'] + sorted(glob.glob('songs_images/*.wav'))
+SYNTHETIC_AUDIO_SECONDS = [3, 30, 120, 600]
+SYNTHETIC_TRACK_SECONDS = [30, 200, 600]
+
+
+def load_models():
+
+    from algorhythmic.models import load_listening_model, load_scraping_model
+
+    models = {}
+    for name, loader, n_features in [('listening', load_listening_model, 49),
+                                     ('scraping', load_scraping_model, len(important_features))]:
+        try:
+            models[name] = (loader(), 'real')
+        except Exception as error:
+            print(f"{name} model unavailable ({type(error).__name__}), using a stand-in")
+            models[name] = (StandInModel(n_features), 'stand-in')
+
+    return models
+
+
+def synthetic_wav(seconds, sr=44100, seed=0):
+
+    # A chord with a pulsing envelope plus noise, as 16 bit stereo WAV bytes
+    import soundfile as sf
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    y = sum(np.sin(2 * np.pi * freq * t) for freq in (220.0, 277.2, 329.6)) / 6
+    y *= 0.6 + 0.4 * np.sin(2 * np.pi * 2 * t) ** 2
+    y += 0.02 * rng.normal(size=t.size)
+
+    buffer = io.BytesIO()
+    sf.write(buffer, np.stack([y, y], axis=1), sr, format='WAV', subtype='PCM_16')
+    return buffer.getvalue()
+
+
+def run_stages(stages, runs):
+
+    # stages is a list of (name, function) where each function takes the
+    # previous stage's output. Returns {stage: (timings, peak_bytes)}.
+    timings = {name: [] for name, _ in stages}
+    peaks = {}
+
+    # Warm-up run, so one-off costs (numba compilation, filterbanks) aren't timed
+    value = None
+    for name, function in stages:
+        value = function(value)
+
+    for _ in range(runs):
+        value = None
+        for name, function in stages:
+            start = time.perf_counter()
+            value = function(value)
+            timings[name].append(time.perf_counter() - start)
+
+    # Separate traced run, tracemalloc slows everything down
+    value = None
+    for name, function in stages:
+        tracemalloc.start()
+        value = function(value)
+        peaks[name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {name: (timings[name], peaks[name]) for name, _ in stages}
+
+
+def listening_stages(audio_bytes, model):
+
+    state = {}
+
+    def decode(_):
+        return decode_audio(audio_bytes)
+
+    def features(decoded):
+        return signal_features(*decoded)
+
+    def condense(signal):
+        state['windows'] = condense_output_features(*signal)
+        return state['windows']
+
+    def inference(windows):
+        return model.predict_proba(windows)
+
+    def votes(probs):
+        return weighted_votes(probs)
+
+    return [('decode', decode), ('features', features), ('condense', condense),
+            ('inference', inference), ('votes', votes)], state
+
+
+def spotify_stages(analysis_json, model):
+
+    state = {}
+
+    def parse(_):
+        return json.loads(analysis_json)
+
+    def segments(analysis):
+        state['track'] = analysis['track']
+        return build_segment_matrix(analysis['segments'])
+
+    def condense(segment_matrix):
+        track_info = state['track']
+        duration = track_info['duration']
+        df = condense_segments(segment_matrix, duration, track_info['end_of_fade_in'],
+                               duration - track_info['start_of_fade_out'])
+        df['tempo'] = round(track_info['tempo'])
+        state['windows'] = df
+        return df
+
+    def inference(df):
+        return model.predict(df[important_features].to_numpy(np.float32), verbose=0)
+
+    def votes(probs):
+        return weighted_votes(probs)
+
+    return [('parse', parse), ('segments', segments), ('condense', condense),
+            ('inference', inference), ('votes', votes)], state
+
+
+def summarise(case, stage, timings, peak, items=1, audio_seconds=None):
+
+    milliseconds = np.array(timings) * 1000
+    mean = milliseconds.mean()
+    result = {'case': case,
+              'stage': stage,
+              'runs': len(timings),
+              'p50_ms': float(np.percentile(milliseconds, 50)),
+              'p90_ms': float(np.percentile(milliseconds, 90)),
+              'p99_ms': float(np.percentile(milliseconds, 99)),
+              'mean_ms': float(mean),
+              'calls_per_s': float(1000 / mean) if mean else None,
+              'windows_per_s': float(items * 1000 / mean) if mean else None,
+              'peak_mb': peak / 1024 ** 2}
+    if audio_seconds is not None:
+        result['audio_x_realtime'] = float(audio_seconds * 1000 / mean) if mean else None
+
+    return result
+
+
+def benchmark_case(case, stages, state, runs, audio_seconds=None):
+
+    stage_results = run_stages(stages, runs)
+    n_windows = len(state.get('windows', ()))
+
+    results = [summarise(case, stage, timings, peak, n_windows, audio_seconds)
+               for stage, (timings, peak) in stage_results.items()]
+    total = np.sum([timings for timings, _ in stage_results.values()], axis=0)
+    results.append(summarise(case, 'total', total,
+                             max(peak for _, peak in stage_results.values()),
+                             n_windows, audio_seconds))
+
+    return results
+
+
+def audio_cases(quick):
+
+    for path in SAMPLE_WAVS:
+        with open(path, 'rb') as file:
+            yield f'wav:{path}', file.read()
+
+    for seconds in SYNTHETIC_AUDIO_SECONDS:
+        if quick and seconds > 30:
+            continue
+        yield f'synthetic-audio:{seconds}s', synthetic_wav(seconds)
+
+
+def spotify_cases(fixture_dir, quick):
+
+    if fixture_dir:
+        for path in sorted(glob.glob(os.path.join(fixture_dir, '*.json'))):
+            with open(path) as file:
+                yield f'fixture:{os.path.basename(path)}', file.read()
+        return
+
+    for seconds in SYNTHETIC_TRACK_SECONDS:
+        if quick and seconds > 200:
+            continue
+        yield f'synthetic-track:{seconds}s', json.dumps(synthetic_analysis(f'bench{seconds}', seconds))
+
+
+def audio_duration(audio_bytes):
+    import soundfile as sf
+    return sf.info(io.BytesIO(audio_bytes)).duration
+
+
+def compare(results, baseline_path, threshold):
+
+    with open(baseline_path) as file:
+        baseline = {(row['case'], row['stage']): row for row in json.load(file)['results']}
+
+    regressions = []
+    print(f"\nAgainst {baseline_path} (p50, flagged if more than {threshold:.0%} slower):")
+    for row in results:
+        before = baseline.get((row['case'], row['stage']))
+        if before is None or not before['p50_ms']:
+            continue
+        ratio = row['p50_ms'] / before['p50_ms']
+        flag = 'REGRESSION' if ratio > 1 + threshold else ''
+        if flag:
+            regressions.append(row)
+        print(f"  {row['case']:34} {row['stage']:10} {before['p50_ms']:10.2f} -> "
+              f"{row['p50_ms']:10.2f} ms  x{ratio:5.2f} {flag}")
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='skip the longest synthetic cases')
+    parser.add_argument('--fixtures', help='directory of audio-analysis JSON fixtures')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args()
+
+    models = load_models()
+    listen_model, listen_kind = models['listening']
+    scrape_model, scrape_kind = models['scraping']
+
+    results = []
+    for case, audio_bytes in audio_cases(args.quick):
+        stages, state = listening_stages(audio_bytes, listen_model)
+        results += benchmark_case(case, stages, state, args.runs, audio_duration(audio_bytes))
+
+    for case, analysis_json in spotify_cases(args.fixtures, args.quick):
+        stages, state = spotify_stages(analysis_json, scrape_model)
+        results += benchmark_case(case, stages, state, args.runs)
+
+    print(f"{'case':34} {'stage':10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+          f"{'windows/s':>10} {'peak MB':>8}")
+    for row in results:
+        print(f"{row['case']:34} {row['stage']:10} {row['p50_ms']:9.2f} {row['p90_ms']:9.2f} "
+              f"{row['p99_ms']:9.2f} {row['windows_per_s'] or 0:10.0f} {row['peak_mb']:8.1f}")
+
+    if args.json:
+        import resource
+        meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'runs': args.runs,
+                'listening_model': listen_kind,
+                'scraping_model': scrape_kind,
+                'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+        with open(args.json, 'w') as file:
+            json.dump({'meta': meta, 'results': results}, file, indent=2)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
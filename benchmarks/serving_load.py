@@ -0,0 +1,119 @@
+# Load test for the model server (algorhythmic.serving). Starts a server with
+# stand-in models on a free localhost port (or uses --address), then runs
+# 1, 2, 4, ... concurrent clients, each sending --requests requests of
+# --windows windows, and reports requests/s, windows/s, latency percentiles
+# and how many requests the server batched into each model call.
+#
+#   python benchmarks/serving_load.py [--model scraping] [--concurrency 1,2,4,8,16,32,64]
+#                                     [--max-wait-ms 5] [--address 127.0.0.1:6150]
+#                                     [--json results.json]
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from algorhythmic.serving import ModelClient, MODEL_FEATURES
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, max_wait_ms):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, '-m', 'algorhythmic.serving', '--stand-in',
+                                '--port', str(port), '--max-wait-ms', str(max_wait_ms)],
+                               cwd=root, stdout=subprocess.PIPE, text=True)
+    # The server prints one line once it's listening
+    print(process.stdout.readline().strip())
+    return process
+
+
+def run_clients(address, model, concurrency, requests, windows):
+
+    latencies = [[] for _ in range(concurrency)]
+    x = np.random.default_rng(0).random((windows, MODEL_FEATURES[model]), dtype=np.float32)
+    client = ModelClient(address)
+    barrier = threading.Barrier(concurrency + 1, timeout=60)
+
+    def worker(n):
+        client.predict(model, x)  # connect and warm up outside the timing
+        barrier.wait()
+        for _ in range(requests):
+            start = time.perf_counter()
+            client.predict(model, x)
+            latencies[n].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    before = client.stats()[model]
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    after = client.stats()[model]
+
+    milliseconds = np.concatenate(latencies) * 1000
+    total = concurrency * requests
+    batches = after['batches'] - before['batches']
+    return {'concurrency': concurrency,
+            'requests': total,
+            'requests_per_s': total / seconds,
+            'windows_per_s': total * windows / seconds,
+            'p50_ms': float(np.percentile(milliseconds, 50)),
+            'p99_ms': float(np.percentile(milliseconds, 99)),
+            'requests_per_batch': (after['requests'] - before['requests']) / batches if batches else 0.0}
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='scraping', choices=sorted(MODEL_FEATURES))
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32,64')
+    parser.add_argument('--requests', type=int, default=50, help='requests per client')
+    parser.add_argument('--windows', type=int, default=60, help='windows per request')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--address', help='use an already running server')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    process = None
+    if args.address:
+        address = args.address
+    else:
+        port = free_port()
+        process = start_server(port, args.max_wait_ms)
+        address = f'127.0.0.1:{port}'
+
+    results = []
+    try:
+        print(f"{'clients':>7} {'req/s':>9} {'windows/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'req/batch':>9}")
+        for concurrency in [int(n) for n in args.concurrency.split(',')]:
+            result = run_clients(address, args.model, concurrency, args.requests, args.windows)
+            results.append(result)
+            print(f"{concurrency:7d} {result['requests_per_s']:9.0f} {result['windows_per_s']:10.0f} "
+                  f"{result['p50_ms']:8.2f} {result['p99_ms']:8.2f} {result['requests_per_batch']:9.1f}")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'model': args.model, 'windows': args.windows, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
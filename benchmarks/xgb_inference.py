@@ -0,0 +1,84 @@
+# Latency of the listening model's inference paths at 1, 10, 100 and 10,000
+# windows: XGBClassifier.predict_proba on a DataFrame (what predict_output
+# used to do) against XGBoostEngine (inplace_predict on float32) with every
+# core and with one thread. Also checks that the probabilities match.
+#
+#   python benchmarks/xgb_inference.py [--sizes 1,10,100,10000] [--runs 20]
+#                                      [--json results.json]
+#
+# The real model is used when it can be loaded, otherwise a stand-in trained
+# on random windows (algorhythmic.stub.xgb_stand_in).
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from algorhythmic.inference import XGBoostEngine
+
+
+def load_model():
+    try:
+        from algorhythmic.models import load_listening_model
+        return load_listening_model(), 'real'
+    except Exception as error:
+        print(f"listening model unavailable ({type(error).__name__}), using a stand-in")
+        from algorhythmic.stub import xgb_stand_in
+        return xgb_stand_in(), 'stand-in'
+
+
+def timings(function, runs):
+    function()
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return np.array(seconds) * 1000
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1,10,100,10000')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    model, kind = load_model()
+    columns = list(model.feature_names_in_)
+    modes = {'predict_proba': model.predict_proba,
+             'engine': XGBoostEngine(model).predict_proba,
+             'engine-1-thread': XGBoostEngine(model, n_threads=1).predict_proba}
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(f"{'windows':>7} {'mode':16} {'p50 ms':>9} {'p90 ms':>9} {'windows/s':>11} {'max diff':>9}")
+    for size in [int(n) for n in args.sizes.split(',')]:
+        frame = pd.DataFrame(rng.random((size, len(columns)), dtype=np.float32), columns=columns)
+        reference = model.predict_proba(frame)
+        runs = max(3, args.runs // (1 + size // 1000))
+        for mode, predict in modes.items():
+            milliseconds = timings(lambda: predict(frame), runs)
+            result = {'windows': size,
+                      'mode': mode,
+                      'p50_ms': float(np.percentile(milliseconds, 50)),
+                      'p90_ms': float(np.percentile(milliseconds, 90)),
+                      'windows_per_s': float(size * 1000 / np.median(milliseconds)),
+                      'max_abs_diff': float(np.abs(predict(frame) - reference).max())}
+            results.append(result)
+            print(f"{size:7d} {mode:16} {result['p50_ms']:9.3f} {result['p90_ms']:9.3f} "
+                  f"{result['windows_per_s']:11.0f} {result['max_abs_diff']:9.2g}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'model': kind, 'cpus': os.cpu_count(), 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
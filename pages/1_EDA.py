@@ -2,46 +2,43 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 
-import os
-
-import matplotlib.pyplot as plt
-
 import seaborn as sns
 
 import plotly.graph_objects as go
 import plotly.express as px
 
+from algorhythmic.dataset import dataset_fingerprint, load_dataset, load_box_stats
+
 # Set the list of features that are important for the model
 important_features = ['tempo','chroma0_mean','chroma1_mean',
                       'mfcc0_mean','mfcc1_mean','mfcc2_mean',
                       'mfcc3_mean', 'start_max_mean','max_loud_mean']
 
-@st.cache_data
-def make_full_df():
-    dir_path = './data/'
-    csv_files = [file for file in os.listdir(dir_path) if file.endswith('.csv')]
-    df_list = []
-    for file in csv_files:
-        df = pd.read_csv(os.path.join(dir_path, file))
-        df_list.append(df)
-    full_df = pd.concat(df_list, ignore_index=True)
+# Only these columns are read from ./data/, see algorhythmic.dataset
+eda_columns = ['title','artist','year','genre'] + important_features
+
+@st.cache_resource
+def make_full_df(fingerprint):
+    # Shared by every session instead of copied per rerun. The fingerprint
+    # changes with the CSVs, which starts a fresh load.
+    full_df, _ = load_dataset('./data/', eda_columns)
 
     return full_df
 
 
 @st.cache_data
-def make_artist_df():
-    artist_df = full_df.drop_duplicates(subset='title', keep='first')
-    artist_df = artist_df[['artist','title','year','genre']]
+def make_artist_df(fingerprint, _full_df):
+    artist_df = _full_df.drop_duplicates(subset='title', keep='first')
+    artist_df = artist_df[['artist','title','year','genre']].astype({'artist': str, 'title': str, 'genre': str})
     artist_df.reset_index(inplace=True, drop=True)
 
     return artist_df
 
 
 @st.cache_data
-def make_grouped_df():
-    grouped_df = artist_df.groupby('genre')['title'].nunique().sort_values(ascending=False).reset_index()
-    temp_year = artist_df.groupby('genre')[['year']].mean().round().astype(int)
+def make_grouped_df(fingerprint, _artist_df):
+    grouped_df = _artist_df.groupby('genre')['title'].nunique().sort_values(ascending=False).reset_index()
+    temp_year = _artist_df.groupby('genre')[['year']].mean().round().astype(int)
     grouped_df = grouped_df.merge(temp_year, on='genre')
     grouped_df.columns = ['genre','count','avg_year']
     grouped_df['genre'] = grouped_df['genre'].str.title()
@@ -50,10 +47,10 @@ def make_grouped_df():
 
 
 @st.cache_data
-def make_year_df():
-    year_df = artist_df.groupby('year')[['title']].count().reset_index()
+def make_year_df(fingerprint, _artist_df):
+    year_df = _artist_df.groupby('year')[['title']].count().reset_index()
     year_df = year_df[1:]
-    temp_title = artist_df.groupby('year')['title'].unique().reset_index()
+    temp_title = _artist_df.groupby('year')['title'].unique().reset_index()
     temp_title = pd.DataFrame(temp_title)
     temp_title = temp_title[1:]
     year_df = year_df.merge(temp_title, on='year')
@@ -63,8 +60,37 @@ def make_year_df():
     return year_df
 
 
+@st.cache_resource
+def make_box_stats(fingerprint, _full_df):
+    # Quartiles, whiskers and outliers of every feature per genre, computed
+    # once per dataset and kept next to the dataset cache
+    return load_box_stats(_full_df, fingerprint, important_features)
+
+
+@st.cache_data
+def make_box_plot(fingerprint, variable):
+    stats, outliers = make_box_stats(fingerprint, full_df)
+    stats = stats[stats['feature'] == variable]
+    outliers = outliers[outliers['feature'] == variable]
+    colors = dict(zip(stats['genre'], sns.color_palette('husl', len(stats)).as_hex()))
+
+    fig = go.Figure()
+    for row in stats.itertuples():
+        fig.add_trace(go.Box(x=[row.genre], q1=[row.q1], median=[row.median], q3=[row.q3],
+                             lowerfence=[row.lower], upperfence=[row.upper],
+                             name=row.genre, marker_color=colors[row.genre]))
+    fig.add_trace(go.Scatter(x=outliers['genre'], y=outliers['value'], mode='markers',
+                             marker=dict(color=outliers['genre'].map(colors), size=4),
+                             hoverinfo='y'))
+    fig.update_layout(title=f'{variable} Boxplot for Genres', showlegend=False, height=700,
+                      xaxis_title='Genre', yaxis_title=variable)
+    fig.update_xaxes(tickangle=90)
+
+    return fig
+
+
 @st.cache_data
-def make_genre_plot():
+def make_genre_plot(fingerprint):
     fig = px.bar(grouped_df, x='genre', y='count',
                 hover_data=['count','avg_year'], color='genre',
                 labels={'count':'Count of Songs','avg_year': 'Avg Release Year'}, height=600)
@@ -73,7 +99,7 @@ def make_genre_plot():
 
 
 @st.cache_data
-def make_year_plot():
+def make_year_plot(fingerprint):
     fig1 = px.bar(year_df, x='year', y='count',
                 hover_data=['count'], color='year',
                 labels={'title':'Count of Songs'}, height=600,
@@ -82,10 +108,11 @@ def make_year_plot():
     st.plotly_chart(fig1, use_container_width=True)
 
 
-full_df = make_full_df()
-artist_df = make_artist_df()
-grouped_df = make_grouped_df()
-year_df = make_year_df()
+fingerprint = dataset_fingerprint('./data/', eda_columns)
+full_df = make_full_df(fingerprint)
+artist_df = make_artist_df(fingerprint, full_df)
+grouped_df = make_grouped_df(fingerprint, artist_df)
+year_df = make_year_df(fingerprint, artist_df)
 
 
 if "variable" not in st.session_state:
@@ -108,8 +135,8 @@ st.write("""
 st.write("#### Artists and Songs")
 st.dataframe(artist_df)
 
-make_genre_plot()
-make_year_plot()
+make_genre_plot(fingerprint)
+make_year_plot(fingerprint)
 
 st.write("#### Why these songs and genres?")
 
@@ -187,17 +214,8 @@ st.write("""
 
 variable = st.selectbox(label="Pick a value: ", options=important_features)
 
-x = full_df[["genre", variable]]
-
-f, ax = plt.subplots(figsize=(16, 10));
-sns.boxplot(x = "genre", y = variable, data = x, palette = 'husl');
-
-plt.title(f'{variable} Boxplot for Genres', fontsize = 25)
-plt.xticks(fontsize = 14,rotation=90)
-plt.yticks(fontsize = 10)
-plt.xlabel("Genre", fontsize = 15)
-plt.ylabel(variable, fontsize = 15)
-st.pyplot(f)
+box_plot = make_box_plot(fingerprint, variable)
+st.plotly_chart(box_plot, use_container_width=True)
 
 st.text("")
 st.text("")
@@ -1,10 +1,16 @@
 import streamlit as st
 
-import xgboost as xgb
+import os
 
-from utils import (name_dict,
+from algorhythmic.rec_index import RecommendationIndex, index_version
+from algorhythmic.similarity import SimilarityIndex
+from algorhythmic.clustering import ClusterModel
+from utils import (model_registry,
+                   name_dict,
                    predict_output,
-                   get_spotify_recs)
+                   get_spotify_recs,
+                   get_similar_songs,
+                   get_song_clusters)
 
 # Imports for scraping Spotify
 import spotipy
@@ -27,14 +33,39 @@ def api_call():
 sp = api_call()
 
 
+# Returns at once, predictions wait for the model to finish loading
+listen_model = model_registry().model('listening')
+
+
+@st.cache_resource(max_entries=1)
+def load_rec_index(version):
+    # Offline recommendations, built by `python -m algorhythmic.rec_index`.
+    # Keyed on the build, so a rebuilt index is picked up on the next rerun.
+    if version is not None:
+        return RecommendationIndex('./models/rec_index/')
+    return None
+
+rec_index = load_rec_index(index_version('./models/rec_index/'))
+
+
 @st.cache_resource
-def load_listening_model():
-    # Set the model for listening
-    listen_model = xgb.XGBClassifier()
-    listen_model.load_model('./models/new_xgb.h5')
-    return listen_model
+def load_similarity_index():
+    # Songs by sound, built by `python -m algorhythmic.similarity`
+    if os.path.exists('./models/similarity/records.json'):
+        return SimilarityIndex.load('./models/similarity/')
+    return None
+
+similarity_index = load_similarity_index()
 
-listen_model = load_listening_model()  
+
+@st.cache_resource
+def load_clusters():
+    # Data-driven song categories, fitted by `python -m algorhythmic.clustering`
+    if os.path.exists('./models/clusters/centroids.npy'):
+        return ClusterModel.load('./models/clusters/')
+    return None
+
+clusters = load_clusters()
     
 
 st.markdown("# Let's test some sounds!") 
@@ -106,8 +137,14 @@ if st.button("Evalute"):
         Using those values, we determined that this audio best suits these genres:""")
         st.write(listen_preds)
 
+        if clusters is not None:
+            get_song_clusters(clusters, details_df)
+
+        if similarity_index is not None:
+            get_similar_songs(similarity_index, details_df)
+
         st.write("Here are some less known songs from these genres!")
-        get_spotify_recs(sp, listen_preds)
+        get_spotify_recs(sp, listen_preds, rec_index)
 
         st.write("""
         If you would like to test another sound, scroll up and click the 
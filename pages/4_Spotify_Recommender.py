@@ -1,18 +1,23 @@
 import streamlit as st
 
-# Imports for tensorflow
-import tensorflow as tf
-from tensorflow import keras
+import os
 
 # Imports for scraping Spotify
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 
-from utils import (display_spotify,
+from algorhythmic import AnalysisCache, FeatureStore
+from algorhythmic.rec_index import RecommendationIndex, index_version
+from algorhythmic.similarity import SimilarityIndex
+from algorhythmic.clustering import ClusterModel
+from utils import (model_registry,
+                   display_spotify,
                    get_spotify_df,
                    predict_spotify,
                    name_dict,
-                   get_spotify_recs)
+                   get_spotify_recs,
+                   get_similar_songs,
+                   get_song_clusters)
 
 
 # Session states for Spotify Prediction
@@ -59,13 +64,8 @@ def reset_form():
     st.session_state.predicted_spotify = False
 
 
-@st.cache_resource
-def load_scraping_model():
-    # Set the model for Spotify Scraping
-    scrape_model = keras.models.load_model('./models/keras_2/')
-    return scrape_model
-
-scrape_model = load_scraping_model()
+# Returns at once, predictions wait for the model to finish loading
+scrape_model = model_registry().model('scraping')
 
 @st.cache_resource(ttl=3600)
 def api_call():
@@ -82,6 +82,55 @@ def api_call():
 sp = api_call()
 
 
+@st.cache_resource
+def load_analysis_cache():
+    # Audio analyses are kept on disk so popular songs skip the Spotify call
+    analysis_cache = AnalysisCache('./cache/audio_analysis/')
+    return analysis_cache
+
+analysis_cache = load_analysis_cache()
+
+
+@st.cache_resource
+def load_feature_store():
+    # Condensed windows of songs we've already seen, for the current pipeline
+    feature_store = FeatureStore('./cache/features/')
+    return feature_store
+
+feature_store = load_feature_store()
+
+
+@st.cache_resource(max_entries=1)
+def load_rec_index(version):
+    # Offline recommendations, built by `python -m algorhythmic.rec_index`.
+    # Keyed on the build, so a rebuilt index is picked up on the next rerun.
+    if version is not None:
+        return RecommendationIndex('./models/rec_index/')
+    return None
+
+rec_index = load_rec_index(index_version('./models/rec_index/'))
+
+
+@st.cache_resource
+def load_similarity_index():
+    # Songs by sound, built by `python -m algorhythmic.similarity`
+    if os.path.exists('./models/similarity/records.json'):
+        return SimilarityIndex.load('./models/similarity/')
+    return None
+
+similarity_index = load_similarity_index()
+
+
+@st.cache_resource
+def load_clusters():
+    # Data-driven song categories, fitted by `python -m algorhythmic.clustering`
+    if os.path.exists('./models/clusters/centroids.npy'):
+        return ClusterModel.load('./models/clusters/')
+    return None
+
+clusters = load_clusters()
+
+
 st.markdown("# Let's test Spotify")
 st.write("")
 st.write("")
@@ -138,7 +187,8 @@ if st.session_state.wrong_guess:
 
 if st.session_state.shown_albums:
     try:
-        df_spotify = get_spotify_df(sp, song_title, artist_name)
+        df_spotify = get_spotify_df(sp, song_title, artist_name,
+                                    cache=analysis_cache, store=feature_store)
 
         st.write(df_spotify)
 
@@ -149,8 +199,22 @@ if st.session_state.shown_albums:
 
         st.write(spotify_preds)
 
+        if clusters is not None:
+            get_song_clusters(clusters, df_spotify)
+
+        if similarity_index is not None:
+            song = {'title': df_spotify['title'].iloc[0],
+                    'artist': df_spotify['artist'].iloc[0],
+                    'genre': spotify_preds.index[0],
+                    'track_id': None}
+            # Leave the song itself out, it's in the catalog from the first run
+            get_similar_songs(similarity_index, df_spotify, exclude=song)
+            # Classified tracks join the catalog (and its added.jsonl) for
+            # later searches. Adding it again on a rerun does nothing.
+            similarity_index.add_song(df_spotify, song)
+
         if st.button("Would you like to some songs recommendations?", key='second'):
-            get_spotify_recs(sp, spotify_preds)
+            get_spotify_recs(sp, spotify_preds, rec_index)
     
         st.session_state.predicted_spotify = True
     
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from algorhythmic.features import important_features
+from algorhythmic.similarity import SimilarityIndex
+
+
+def make_index(sizes, seed=0):
+    # One tight cluster of songs per size, far apart from each other
+    rng = np.random.default_rng(seed)
+    d = len(important_features)
+    vectors = np.concatenate([rng.normal(10 * n, 0.1, (size, d)) for n, size in enumerate(sizes)])
+    records = [{'title': f'song {n}', 'artist': 'artist', 'genre': None, 'track_id': None}
+               for n in range(len(vectors))]
+    return SimilarityIndex(vectors, records, center=np.zeros(d), scale=np.ones(d)), vectors
+
+
+def test_ivf_unbalanced_lists():
+    index, vectors = make_index([50, 3])
+    index.train_ivf(4)
+    query = vectors[-1]
+
+    # The list closest to the query holds fewer than k songs
+    closest = np.argmin(((index.centroids - query) ** 2).sum(axis=1))
+    assert (index.assignments == closest).sum() < 5
+
+    rows, distances = index.search(query, k=5, mode='ivf', n_probe=1)
+    assert rows.shape == (1, 5)
+    assert distances.shape == (1, 5)
+    assert (rows >= 0).all()
+    assert set(rows[0, :3]) == {50, 51, 52}
+    assert (np.diff(distances[0]) >= 0).all()
+
+    # Approximate past the query's own cluster, exact within it
+    exact_rows, exact_distances = index.search(query, k=5)
+    assert exact_rows.shape == (1, 5)
+    assert np.array_equal(rows[0, :3], exact_rows[0, :3])
+    assert np.allclose(distances[0, :3], exact_distances[0, :3])
+
+
+def test_ivf_empty_lists():
+    index, vectors = make_index([20, 20])
+    index.train_ivf(2)
+    # An empty list nearest to the query, the songs further away
+    index.centroids = np.concatenate([vectors[-1:], index.centroids])
+    index.assignments = index.assignments + 1
+    index._lists = None
+
+    rows, distances = index.search(vectors[-1], k=5, mode='ivf', n_probe=1)
+    assert rows.shape == (1, 5)
+    assert (rows >= 0).all()
+    assert np.isfinite(distances).all()
+
+
+def test_padding_when_catalog_is_smaller_than_k():
+    index, vectors = make_index([3])
+    index.train_ivf(2)
+    queries = vectors[:2]
+
+    for mode in ['exact', 'ivf']:
+        rows, distances = index.search(queries, k=5, mode=mode)
+        assert rows.shape == (2, 5)
+        assert distances.shape == (2, 5)
+        assert (rows[:, :3] >= 0).all()
+        assert (rows[:, 3:] == -1).all()
+        assert np.isinf(distances[:, 3:]).all()
+
+    rows, distances = index.search(queries, k=0, mode='ivf')
+    assert rows.shape == (2, 0)
+
+    # similar_songs leaves the padding out
+    df = pd.DataFrame(vectors[:1], columns=important_features)
+    similar = index.similar_songs(df, k=5, mode='ivf')
+    assert len(similar) == 3
+    assert np.isfinite(similar['distance']).all()